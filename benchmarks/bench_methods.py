@@ -0,0 +1,215 @@
+"""
+Benchmarks for every interpolation method, run with asv (``asv run --python=same``). Inputs are generated by
+:mod:`benchmarks.synthetic`, so no data has to be downloaded. ``time_`` benchmarks record wall time, ``peakmem_`` benchmarks
+record peak memory, and ``track_mass_error`` records the relative difference between source and interpolated totals, which
+should stay at floating point noise.
+"""
+import warnings
+
+import numpy as np
+
+from pypolate.areal import areal, areal_apply, areal_weights
+from pypolate.binary import binary
+from pypolate.expert import expert
+from pypolate.lim_var import lim_var
+from pypolate.n_class import n_class
+from pypolate.overlay import intersection_areas, overlay
+from pypolate.parcel import parcel
+
+from .synthetic import CELL, grid, landuse_mosaic, nested_grids, parcel_fabric, voronoi_zones
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+CLASS_DICT = {1: 0.3, 2: 0.2, 3: 0.15, 4: 0.1, 5: 0.1, 6: 0.05, 7: 0.05, 8: 0.03, 9: 0.02}
+
+THRESHOLDS = {1: None, 2: 0.05, 3: 0.02, 4: 0.01, 5: 0.005, 6: 0.002, 7: 0.001, 8: 0.0005, 9: 0.0001}
+
+def extent(n):
+    """Extent holding n grid cells, so feature density is the same at every size."""
+
+    side = max(int(round(np.sqrt(n))), 1) * CELL
+    return (0.0, 0.0, side, side)
+
+
+def mass_error(source_total, interpolated_total):
+    """Relative difference between a source total and an interpolated total."""
+
+    return abs(interpolated_total - source_total) / abs(source_total)
+
+
+class Base:
+    params = SIZES
+    param_names = ['n_features']
+    timeout = 3600
+
+    def setup(self, n):
+        warnings.simplefilter('ignore')
+
+
+class Overlay(Base):
+    """Intersection stage shared by every method: n land use polygons against n / 10 zones."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.source = voronoi_zones(n // 10, extent(n))
+        self.ancillary = landuse_mosaic(n, extent(n))
+
+    def time_overlay(self, n):
+        overlay(self.source, self.ancillary)
+
+    def peakmem_overlay(self, n):
+        overlay(self.source, self.ancillary)
+
+    def time_overlay_tiled(self, n):
+        overlay(self.source, self.ancillary, n_jobs=-1)
+
+    def time_intersection_areas(self, n):
+        intersection_areas(self.source, self.ancillary)
+
+    def peakmem_intersection_areas(self, n):
+        intersection_areas(self.source, self.ancillary)
+
+
+class Areal(Base):
+    """Areal weighting from n / 10 irregular zones to a grid of n cells."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.source = voronoi_zones(n // 10, extent(n))
+        self.target = grid(n)
+        self.weights = areal_weights(self.source, self.target)
+
+    def time_areal(self, n):
+        areal(self.source, self.target, ['pop', 'jobs'])
+
+    def peakmem_areal(self, n):
+        areal(self.source, self.target, ['pop', 'jobs'])
+
+    def time_areal_weights(self, n):
+        areal_weights(self.source, self.target)
+
+    def peakmem_areal_weights(self, n):
+        areal_weights(self.source, self.target)
+
+    def time_areal_apply(self, n):
+        areal_apply(self.weights, self.source, self.target, ['pop', 'jobs'])
+
+    def track_mass_error(self, n):
+        result = areal_apply(self.weights, self.source, self.target, ['pop'])
+        return mass_error(self.source['pop'].sum(), result['pop'].sum())
+
+
+class Binary(Base):
+    """Binary method from n / 10 irregular zones with a land use mosaic of n polygons."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.source = voronoi_zones(n // 10, extent(n))
+        self.ancillary = landuse_mosaic(n, extent(n))
+
+    def time_binary(self, n):
+        binary(self.source, self.ancillary, 'landuse', [8, 9], '_intp', ['pop'])
+
+    def peakmem_binary(self, n):
+        binary(self.source, self.ancillary, 'landuse', [8, 9], '_intp', ['pop'])
+
+    def time_binary_no_geometry(self, n):
+        binary(self.source, self.ancillary, 'landuse', [8, 9], '_intp', ['pop'], return_geometry=False)
+
+    def track_mass_error(self, n):
+        result = binary(self.source, self.ancillary, 'landuse', [8, 9], '_intp', ['pop'], return_geometry=False)
+
+        #zones that are entirely excluded keep none of their values
+        kept = self.source['zone'].isin(result['zone'])
+        return mass_error(self.source.loc[kept, 'pop'].sum(), result['pop_intp'].sum())
+
+
+class NClass(Base):
+    """N-class method from n / 10 irregular zones with a land use mosaic of n polygons."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.source = voronoi_zones(n // 10, extent(n))
+        self.ancillary = landuse_mosaic(n, extent(n))
+
+    def time_n_class(self, n):
+        n_class(self.source, self.ancillary, 'landuse', CLASS_DICT, ['pop'], suffix='_intp')
+
+    def peakmem_n_class(self, n):
+        n_class(self.source, self.ancillary, 'landuse', CLASS_DICT, ['pop'], suffix='_intp')
+
+    def time_n_class_no_geometry(self, n):
+        n_class(self.source, self.ancillary, 'landuse', CLASS_DICT, ['pop'], suffix='_intp', return_geometry=False)
+
+    def track_mass_error(self, n):
+        result = n_class(self.source, self.ancillary, 'landuse', CLASS_DICT, ['pop'], suffix='_intp', return_geometry=False)
+        return mass_error(self.source['pop'].sum(), result['pop_intp'].sum())
+
+
+class LimVar(Base):
+    """Limiting variable method from n / 10 irregular zones with a land use mosaic of n polygons."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.source = voronoi_zones(n // 10, extent(n))
+        self.ancillary = landuse_mosaic(n, extent(n))
+
+    def time_lim_var(self, n):
+        lim_var(self.source, self.ancillary, 'landuse', THRESHOLDS, ['pop', 'jobs'], suffix='_intp')
+
+    def peakmem_lim_var(self, n):
+        lim_var(self.source, self.ancillary, 'landuse', THRESHOLDS, ['pop', 'jobs'], suffix='_intp')
+
+    def time_lim_var_no_geometry(self, n):
+        lim_var(self.source, self.ancillary, 'landuse', THRESHOLDS, ['pop', 'jobs'], suffix='_intp', return_geometry=False)
+
+    def track_mass_error(self, n):
+        result = lim_var(self.source, self.ancillary, 'landuse', THRESHOLDS, ['pop'], 'zone', '_intp', return_geometry=False)
+
+        #only zones with some unrestricted land use can place all of their values
+        kept = self.source['zone'].isin(result.loc[result['landuse'] == 1, 'zone'])
+        return mass_error(self.source.loc[kept, 'pop'].sum(), result.loc[result['zone'].isin(self.source.loc[kept, 'zone']), 'pop_intp'].sum())
+
+
+class Parcel(Base):
+    """Parcel method from a grid of n / 100 zones to a fabric of n tax lots."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.zone, _ = nested_grids(max(n // 100, 1))
+        self.parcel = parcel_fabric(n, tuple(self.zone.total_bounds))
+
+    def time_parcel_overlay(self, n):
+        parcel(self.zone, self.parcel, 'tu', 'ru', 'ba', 'ra', ['pop'])
+
+    def peakmem_parcel_overlay(self, n):
+        parcel(self.zone, self.parcel, 'tu', 'ru', 'ba', 'ra', ['pop'])
+
+    def time_parcel_point(self, n):
+        parcel(self.zone, self.parcel, 'tu', 'ru', 'ba', 'ra', ['pop'], assignment='point')
+
+    def peakmem_parcel_point(self, n):
+        parcel(self.zone, self.parcel, 'tu', 'ru', 'ba', 'ra', ['pop'], assignment='point')
+
+    def track_mass_error(self, n):
+        result = parcel(self.zone, self.parcel, 'tu', 'ru', 'ba', 'ra', ['pop'], assignment='point')
+        return mass_error(self.zone['pop'].sum(), result['ru_derived_pop'].sum())
+
+
+class Expert(Base):
+    """CEDS expert system with block groups of n / 100 cells nested in tracts and a fabric of n tax lots."""
+
+    def setup(self, n):
+        super().setup(n)
+        self.small_zone, self.large_zone = nested_grids(max(n // 100, 16))
+        self.parcel = parcel_fabric(n, tuple(self.small_zone.total_bounds))
+
+    def time_expert(self, n):
+        expert(self.large_zone, self.small_zone, self.parcel, 'tu', 'ru', 'ba', 'ra', 'pop', assignment='point')
+
+    def peakmem_expert(self, n):
+        expert(self.large_zone, self.small_zone, self.parcel, 'tu', 'ru', 'ba', 'ra', 'pop', assignment='point')
+
+    def track_mass_error(self, n):
+        result = expert(self.large_zone, self.small_zone, self.parcel, 'tu', 'ru', 'ba', 'ra', 'pop', assignment='point')
+        return mass_error(self.small_zone['pop'].sum(), result['expert_system_interpolation'].sum())
@@ -0,0 +1,147 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+#side length of one square cell, in map units
+CELL = 100.0
+
+def grid(n, cell = CELL, **columns):
+    """
+    Generates a square grid of about n square polygons, starting at the origin.
+
+    :param n: Approximate number of polygons
+    :type n: int
+    :param cell: Side length of each polygon. The default is 100
+    :type cell: float, optional
+    :param columns: Extra columns to add, as name=array
+    :type columns: numpy.ndarray, optional
+
+    :return: Grid polygons
+    :rtype: DataFrame
+    """
+
+    side = max(int(round(np.sqrt(n))), 1)
+    x, y = np.meshgrid(np.arange(side) * cell, np.arange(side) * cell)
+    x, y = x.ravel(), y.ravel()
+    return gpd.GeoDataFrame(columns, geometry=shapely.box(x, y, x + cell, y + cell))
+
+
+def nested_grids(n, nest = 4, seed = 0):
+    """
+    Generates a fine grid of about n polygons and a coarse grid whose polygons each hold nest x nest fine polygons, like block
+    groups nesting in tracts. Both carry a 'pop' column, and the coarse 'pop' is the sum of the fine polygons it holds.
+
+    :param n: Approximate number of fine polygons
+    :type n: int
+    :param nest: Number of fine polygons along each side of a coarse polygon. The default is 4
+    :type nest: int, optional
+    :param seed: Random seed. The default is 0
+    :type seed: int, optional
+
+    :return: Fine and coarse grids
+    :rtype: tuple
+    """
+
+    rng = np.random.default_rng(seed)
+    side = max(int(round(np.sqrt(n) / nest)), 1) * nest
+    fine = grid(side * side, pop=rng.integers(0, 2000, side * side).astype(float))
+    coarse = grid((side // nest) ** 2, cell=CELL * nest)
+
+    #sum fine values into the coarse polygon holding them
+    row, column = np.divmod(np.arange(side * side), side)
+    coarse_index = (row // nest) * (side // nest) + column // nest
+    coarse['pop'] = np.bincount(coarse_index, weights=fine['pop'], minlength=len(coarse))
+    return fine, coarse
+
+
+def voronoi_zones(n, extent, seed = 0):
+    """
+    Generates about n irregular zones as the Voronoi diagram of random points, clipped to an extent. Zones carry a 'zone'
+    identifier and 'pop' and 'jobs' columns.
+
+    :param n: Number of zones
+    :type n: int
+    :param extent: Bounds (minx, miny, maxx, maxy) to fill
+    :type extent: tuple
+    :param seed: Random seed. The default is 0
+    :type seed: int, optional
+
+    :return: Voronoi zones
+    :rtype: DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = extent
+    points = shapely.points(rng.uniform(minx, maxx, n), rng.uniform(miny, maxy, n))
+    frame = shapely.box(minx, miny, maxx, maxy)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points), extend_to=frame))
+    cells = shapely.intersection(cells, frame)
+    return gpd.GeoDataFrame({'zone': np.arange(len(cells)),
+                             'pop': rng.integers(0, 5000, len(cells)).astype(float),
+                             'jobs': rng.integers(0, 5000, len(cells)).astype(float)}, geometry=cells)
+
+
+def landuse_mosaic(n, extent, n_classes = 9, seed = 1):
+    """
+    Generates a land use mosaic of about n polygons covering an extent, with an integer 'landuse' class from 1 to n_classes.
+    Neighbouring polygons often share a class, as they do in real land use layers.
+
+    :param n: Number of polygons
+    :type n: int
+    :param extent: Bounds (minx, miny, maxx, maxy) to fill
+    :type extent: tuple
+    :param n_classes: Number of land use classes. The default is 9
+    :type n_classes: int, optional
+    :param seed: Random seed. The default is 1
+    :type seed: int, optional
+
+    :return: Land use polygons
+    :rtype: DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    mosaic = voronoi_zones(n, extent, seed)[['geometry']]
+
+    #classes vary smoothly across the extent with some noise
+    minx, miny, maxx, maxy = extent
+    centroid = mosaic.geometry.centroid
+    smooth = (np.sin(centroid.x / (maxx - minx) * 7) + np.cos(centroid.y / (maxy - miny) * 5) + 2) / 4
+    noise = rng.random(len(mosaic)) < 0.3
+    landuse = np.where(noise, rng.integers(0, n_classes, len(mosaic)), (smooth * n_classes).astype(int))
+    mosaic['landuse'] = np.clip(landuse, 0, n_classes - 1) + 1
+    return mosaic
+
+
+def parcel_fabric(n, extent, seed = 2):
+    """
+    Generates about n rectangular tax lots covering an extent, with total units ('tu'), residential units ('ru'), building
+    area ('ba') and residential area ('ra') columns. About a third of residential lots have no recorded residential area.
+
+    :param n: Approximate number of parcels
+    :type n: int
+    :param extent: Bounds (minx, miny, maxx, maxy) to fill
+    :type extent: tuple
+    :param seed: Random seed. The default is 2
+    :type seed: int, optional
+
+    :return: Parcels
+    :rtype: DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = extent
+
+    #lots are twice as deep as they are wide
+    columns = max(int(round(np.sqrt(2 * n))), 1)
+    rows = max(n // columns, 1)
+    width, depth = (maxx - minx) / columns, (maxy - miny) / rows
+    x, y = np.meshgrid(minx + np.arange(columns) * width, miny + np.arange(rows) * depth)
+    x, y = x.ravel(), y.ravel()
+
+    size = len(x)
+    tu = rng.integers(1, 40, size).astype(float)
+    ru = np.floor(tu * rng.random(size))
+    ba = rng.uniform(100, 5000, size)
+    ra = np.where(rng.random(size) < 0.33, 0, ba * ru / tu)
+    return gpd.GeoDataFrame({'tu': tu, 'ru': ru, 'ba': ba, 'ra': ra},
+                            geometry=shapely.box(x, y, x + width, y + depth))
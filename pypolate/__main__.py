@@ -0,0 +1,5 @@
+import sys
+
+from pypolate.cli import main
+
+sys.exit(main())
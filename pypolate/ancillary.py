@@ -0,0 +1,157 @@
+import hashlib
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from pypolate.cache import hash_geometry
+from pypolate.profiling import profiled, stage
+
+#prepared ancillary layers of recent calls, keyed by a hash of their inputs
+_prepared = OrderedDict()
+MAX_PREPARED = 8
+
+@profiled
+def prepare_ancillary(ancillary, class_col = None, exclude_val = (), by_class = True, explode = True, tolerance = None,
+                      grid_size = None, coverage = False, tile_size = None):
+    """
+    Prepares an ancillary layer for repeated runs of :func:`pypolate.binary.binary`,
+    :func:`pypolate.n_class.n_class` and :func:`pypolate.lim_var.lim_var`. Excluded classes are dropped and the remaining
+    polygons are dissolved, either into one mask per class or into a single binary mask, so adjacent polygons of the same class
+    no longer split source polygons into separate intersected polygons. The dissolved geometry can be snapped to a precision
+    grid and simplified, and it is prepared for fast spatial predicates.
+
+    Dissolved masks are split into their connected parts by default, because intersecting every source polygon with a single
+    multipolygon covering the whole layer is slower than intersecting it with the parts it overlaps. Connected parts of large
+    layers can still have thousands of vertices, which makes every intersection with them slow even though there are fewer
+    intersected polygons. tile_size cuts the masks along a square grid so each piece stays small. Results are kept in memory
+    and returned again when the same ancillary layer is prepared with the same options.
+
+    Pass the prepared layer as the ancillary to the methods. For binary masks, leave out exclude_col and exclude_val:
+    ``binary(source, mask, cols=['pop'])``.
+
+    :param ancillary: DataFrame with ancillary polygons
+    :type ancillary: DataFrame
+    :param class_col: Column with the class of each polygon. The default is None, which dissolves every polygon into a single mask
+    :type class_col: str, optional
+    :param exclude_val: Values of class_col to drop before dissolving. The default is ()
+    :type exclude_val: list, optional
+    :param by_class: Whether to dissolve each class separately. Otherwise kept polygons are dissolved into one binary mask. The default is True
+    :type by_class: bool, optional
+    :param explode: Whether to split dissolved masks into their connected parts. The default is True
+    :type explode: bool, optional
+    :param tolerance: Tolerance for simplifying the dissolved masks, in map units. The default is None, which does not simplify
+    :type tolerance: float, optional
+    :param grid_size: Precision grid to snap vertices to while dissolving, in map units. The default is None, which keeps full precision
+    :type grid_size: float, optional
+    :param coverage: Whether the polygons form a coverage (no overlaps), which allows a much faster dissolve. The default is False
+    :type coverage: bool, optional
+    :param tile_size: Width of the square grid cells the masks are cut along, in map units. The default is None, which does not cut the masks
+    :type tile_size: float, optional
+
+    :return: Prepared ancillary DataFrame with class_col (when dissolving by class) and geometry, and a report of what each step
+        changed. Parts are single polygons, the pieces that split source polygons into intersected polygons. 'polygons_in' is the
+        number of rows of ancillary, 'excluded' the rows dropped by exclude_val and 'parts_in' the parts of the rows kept.
+        'dissolved' is the number of parts merged into others of the same mask or collapsed by grid_size and tolerance, 'tiled'
+        the number of parts added by cutting along the grid, and 'parts_out' and 'polygons_out' the parts and rows of the
+        prepared layer, so parts_out = parts_in - dissolved + tiled
+    :rtype: tuple
+    """
+
+    key = _prepared_key(ancillary, class_col, exclude_val, by_class, explode, tolerance, grid_size, coverage, tile_size)
+    if key in _prepared:
+        _prepared.move_to_end(key)
+        prepared, report = _prepared[key]
+        return prepared, dict(report)
+
+    #drop excluded classes
+    geometry = ancillary.geometry.to_numpy()
+    if class_col is not None:
+        kept = ~ancillary[class_col].isin(exclude_val).to_numpy()
+        geometry = geometry[kept]
+        classes = ancillary[class_col].to_numpy()[kept]
+    else:
+        classes = np.zeros(len(geometry))
+
+    #dissolve one mask per class, or one mask for everything kept
+    with stage('dissolve', len(geometry)) as record:
+        if class_col is not None and by_class:
+            codes, uniques = pd.factorize(classes)
+        else:
+            codes, uniques = np.zeros(len(geometry), dtype=int), np.array([None])
+        masks = np.array([_union(geometry[codes == code], grid_size, coverage) for code in range(len(uniques))],
+                         dtype=object)
+        record.rows_out = len(masks)
+
+    if tolerance:
+        masks = shapely.simplify(masks, tolerance, preserve_topology=True)
+    dissolved_parts = int(shapely.get_num_geometries(masks).sum())
+
+    mask_index = np.arange(len(masks))
+    if tile_size:
+        mask_index, masks = _tile(masks, tile_size)
+
+    frame = {class_col: uniques[mask_index]} if class_col is not None and by_class else {}
+    prepared = gpd.GeoDataFrame(frame, geometry=masks, crs=ancillary.crs)
+    prepared = prepared[~prepared.geometry.is_empty]
+    if explode:
+        prepared = prepared.explode(index_parts=False)
+    prepared = prepared.reset_index(drop=True)
+    shapely.prepare(prepared.geometry.to_numpy())
+
+    #count single polygons before and after dissolving and tiling
+    parts_in = int(shapely.get_num_geometries(geometry).sum())
+    parts_out = int(shapely.get_num_geometries(prepared.geometry.to_numpy()).sum())
+    report = {'polygons_in': len(ancillary), 'excluded': len(ancillary) - len(geometry), 'parts_in': parts_in,
+              'dissolved': parts_in - dissolved_parts, 'tiled': parts_out - dissolved_parts, 'parts_out': parts_out,
+              'polygons_out': len(prepared)}
+
+    _prepared[key] = (prepared, report)
+    if len(_prepared) > MAX_PREPARED:
+        _prepared.popitem(last=False)
+    return prepared, dict(report)
+
+
+def _union(geometry, grid_size, coverage):
+    """Dissolves polygons into one geometry."""
+
+    if coverage and grid_size is None:
+        return shapely.coverage_union_all(geometry)
+    return shapely.union_all(geometry, grid_size=grid_size)
+
+
+def _tile(masks, tile_size):
+    """Cuts masks along a square grid, keeping only the polygons of every piece.
+
+    :return: Position of the mask of every piece, and the pieces
+    :rtype: tuple
+    """
+
+    minx, miny, maxx, maxy = shapely.total_bounds(masks)
+    x, y = np.meshgrid(np.arange(minx, maxx, tile_size), np.arange(miny, maxy, tile_size))
+    cells = shapely.box(x.ravel(), y.ravel(), x.ravel() + tile_size, y.ravel() + tile_size)
+    mask_index, cell_index = shapely.STRtree(cells).query(masks, predicate='intersects')
+    pieces = shapely.intersection(masks[mask_index], cells[cell_index])
+
+    #cutting can leave lines and points where masks touch a grid line, drop them and pieces with no polygon left
+    parts, piece_index = shapely.get_parts(pieces, return_index=True)
+    polygon = shapely.get_type_id(parts) == 3
+    parts, piece_index = parts[polygon], piece_index[polygon]
+    kept, piece_index, n_parts = np.unique(piece_index, return_inverse=True, return_counts=True)
+    pieces = shapely.multipolygons(parts, indices=piece_index)
+    single = n_parts == 1
+    pieces[single] = parts[np.searchsorted(piece_index, np.flatnonzero(single))]
+    return mask_index[kept], pieces
+
+
+def _prepared_key(ancillary, class_col, exclude_val, by_class, explode, tolerance, grid_size, coverage, tile_size):
+    """Hashes an ancillary layer and the options it is prepared with."""
+
+    digest = hashlib.blake2b(repr((class_col, sorted(map(repr, exclude_val)), by_class, explode, tolerance, grid_size,
+                                   coverage, tile_size, str(ancillary.crs))).encode(), digest_size=20)
+    hash_geometry(digest, ancillary.geometry.to_numpy())
+    if class_col is not None:
+        digest.update(pd.util.hash_pandas_object(ancillary[class_col], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
@@ -1,7 +1,12 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
+from scipy import sparse
 
-def areal(source, target, cols = [None], suffix = ''):
+from pypolate.grid import cell_areas, is_grid
+from pypolate.overlay import intersection_areas
+from pypolate.profiling import profiled, stage
+
+@profiled
+def areal(source, target, cols = [None], suffix = '', n_jobs = 1, backend = None, return_operator = False):
     """
     The areal weighting method interpolates data into target polygons by using the ratio of 
     intersected area to source area. It accepts two DataFrames – a source and target, a list of columns to be interpolated, 
@@ -10,46 +15,163 @@ def areal(source, target, cols = [None], suffix = ''):
     The source and target are intersected, and the area of the intersected polygons is calculated. 
     Each intersected area is divided by the source area that encapsulates it for its areal weight. 
     The function then iterates through the selected columns and multiplies each value by the areal weight. 
-    The target DataFrame is returned with the interpolated columns.
+    The target DataFrame is returned with the interpolated columns. The target can also be a regular
+    :class:`pypolate.grid.Grid`, in which case the areas are calculated cell by cell without an overlay and the interpolated
+    columns are returned as 2-D arrays.
 
     :param source: DataFrame with values for interpolation.
     :type source: DataFrame
-    :param target: DataFrame with polygons obtaining interpolated values.
-    :type target: DataFrame   
+    :param target: DataFrame with polygons obtaining interpolated values, or a grid of cells.
+    :type target: DataFrame or Grid
     :param cols: Column(s) from source to be interpolated. 
     :type cols: list
     :param suffix: New name for interpolated columns. The default is ''
     :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_operator: Whether to also return the sparse operator from source polygons to the rows of the result, or to every cell of a grid, see :func:`pypolate.operators.fragment_operator`. The default is False
+    :type return_operator: bool, optional
         
 
-    :returns: Target DataFrame with interpolated columns added
-    :rtype: DataFrame
+    :returns: Target DataFrame with interpolated columns added, or a 2-D array per interpolated column for a grid, with nan in cells no source polygon reaches. With return_operator, a tuple of the result and the operator
+    :rtype: DataFrame or dict or tuple
+    """
+
+    #build areal weights and interpolate designated columns in one step
+    weights = areal_weights(source, target, n_jobs, backend)
+    result = areal_apply(weights, source, target, cols, suffix)
+    if not return_operator:
+        return result
+
+    #the operator is the transposed weights, keeping only the target polygons in the result
+    operator = sparse.csr_matrix(weights.T)
+    if not is_grid(target):
+        operator = operator[np.diff(operator.indptr) > 0]
+    return result, operator
+
+
+@profiled
+def areal_weights(source, target, n_jobs = 1, backend = None):
+    """
+    Builds the areal weights between a source and target DataFrame once, so that they can be reused for any number of
+    columns or vintages of source data that share the same geometry. The areas of the intersections between source and target
+    are calculated without building their geometry, and each intersected area is divided by the area of the source polygon that encapsulates it. The weights are returned as a sparse
+    matrix with one row per source polygon and one column per target polygon, in the positional order of each DataFrame.
+    The matrix can be stored with :func:`save_weights` and loaded again with :func:`load_weights`. For a
+    :class:`pypolate.grid.Grid` target there is one column per cell, and the areas come from :func:`pypolate.grid.cell_areas`.
+
+    :param source: DataFrame with polygons containing values for interpolation.
+    :type source: DataFrame
+    :param target: DataFrame with polygons obtaining interpolated values, or a grid of cells.
+    :type target: DataFrame or Grid
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+
+    :returns: Sparse matrix of intersect_area / source_area with shape (len(source), len(target))
+    :rtype: scipy.sparse.csr_matrix
     """
 
-    #reindex for sum of interpolated results to merge later
-    target['_index'] = target.index
-    
     #calculate source areas
-    source['source_area'] = source.geometry.area
-    
-    #intersect source and target
-    joined1 = gpd.overlay(source, target, how = 'intersection')
-    
-    #calculate intersected areas
-    joined1['intersect_area'] = joined1.geometry.area
-    
+    source_area = source.geometry.area.to_numpy()
+
+    if is_grid(target):
+        #divide the area in every cell by the source area
+        areas = cell_areas(source.geometry.to_numpy(), target)
+        with stage('weights', areas.nnz) as record:
+            weights = sparse.csr_matrix(sparse.diags(1 / np.where(source_area > 0, source_area, np.inf)) @ areas)
+            record.rows_out = weights.nnz
+        return weights
+
+    #calculate intersected areas without building intersected geometries
+    joined1 = intersection_areas(source, target, n_jobs, backend)
+
     #calculate areal weight per intersected polygon
-    joined1["AREAL_WT"] = joined1['intersect_area'] / joined1['source_area']    
-    
-    #interpolate designated columns, create list to include in target dataframe
-    new_cols = []
-    for col in cols:
-        new_col = col + suffix
-        new_cols.append(new_col)
-        joined1[new_col] = joined1["AREAL_WT"] * joined1[col]
-    
-    #merge interpolated results to target dataframe
-    results = joined1.groupby('_index').sum()
-    final = pd.merge(target, results[new_cols], on='_index')
-    del final['_index']
-    return final
\ No newline at end of file
+    with stage('weights', len(joined1)) as record:
+        rows = joined1['src_idx'].to_numpy()
+        columns = joined1['tgt_idx'].to_numpy()
+        areal_wt = joined1['area'].to_numpy() / source_area[rows]
+
+        #duplicate source/target pairs are summed when the matrix is built
+        weights = sparse.csr_matrix((areal_wt, (rows, columns)), shape=(len(source), len(target)))
+        record.rows_out = weights.nnz
+    return weights
+
+
+@profiled
+def areal_apply(weights, source, target, cols = [None], suffix = ''):
+    """
+    Interpolates columns from a source DataFrame into a target DataFrame with areal weights built by :func:`areal_weights`.
+    The source values for all columns are multiplied by the weight matrix in a single sparse matrix product, so no overlay
+    is performed. Only the attribute values of the source are used, so the source can be any DataFrame with the same rows
+    (in the same order) as the one the weights were built from. Target polygons that do not intersect any source polygon are
+    dropped, as they are by :func:`areal`. For a :class:`pypolate.grid.Grid` target, a 2-D array is returned per column.
+
+    :param weights: Areal weights from :func:`areal_weights` or :func:`load_weights`.
+    :type weights: scipy.sparse.csr_matrix
+    :param source: DataFrame with values for interpolation.
+    :type source: DataFrame
+    :param target: DataFrame with polygons obtaining interpolated values, or a grid of cells.
+    :type target: DataFrame or Grid
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+
+    :returns: Target DataFrame with interpolated columns added, or a 2-D array per interpolated column for a grid
+    :rtype: DataFrame or dict
+    """
+
+    if weights.shape != (len(source), len(target)):
+        raise ValueError('weights have shape {} but source and target have shape {}'.format(
+            weights.shape, (len(source), len(target))))
+
+    #interpolate all designated columns with one sparse matrix product
+    new_cols = [col + suffix for col in cols]
+    with stage('interpolate', weights.nnz) as record:
+        values = source[list(cols)].to_numpy(dtype=float)
+        results = weights.T @ values
+        record.rows_out = len(results)
+
+    #keep target polygons that received interpolated values
+    with stage('targets', len(target)) as record:
+        weights = sparse.csc_matrix(weights)
+        hit = np.diff(weights.indptr) > 0
+        if is_grid(target):
+            results[~hit] = np.nan
+            record.rows_out = int(hit.sum())
+            return {col: results[:, i].reshape(target.shape) for i, col in enumerate(new_cols)}
+        final = target[hit].reset_index(drop=True)
+        final[new_cols] = results[hit]
+        record.rows_out = len(final)
+    return final
+
+
+def save_weights(weights, path):
+    """
+    Saves areal weights built by :func:`areal_weights` to disk in scipy's ``.npz`` format.
+
+    :param weights: Areal weights from :func:`areal_weights`.
+    :type weights: scipy.sparse.csr_matrix
+    :param path: File path for the saved weights.
+    :type path: str
+    """
+
+    sparse.save_npz(path, sparse.csr_matrix(weights))
+
+
+def load_weights(path):
+    """
+    Loads areal weights saved with :func:`save_weights`.
+
+    :param path: File path of the saved weights.
+    :type path: str
+
+    :returns: Sparse matrix of areal weights
+    :rtype: scipy.sparse.csr_matrix
+    """
+
+    return sparse.csr_matrix(sparse.load_npz(path))
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import shapely
+
+from pypolate.areal import areal_apply, areal_weights
+from pypolate.binary import binary_apply, binary_weights
+from pypolate.cache import hash_geometry
+from pypolate.grid import is_grid
+from pypolate.raster import is_raster
+
+METHODS = ('areal', 'binary')
+
+REPORT_COLUMNS = ['name', 'method', 'group', 'group_size', 'shared_seconds', 'seconds', 'rows']
+
+#target, ancillary and masks shared by the jobs of a worker process
+_worker_shared = None
+
+class BatchRunner:
+    """
+    Runs many areal or binary interpolations against one shared target or ancillary layer. The spatial index and prepared
+    geometries of the target and of every binary mask are built once and used by every job. Jobs whose sources have the same geometry are grouped, so
+    the overlay and weights are computed once per group and only applied to each job's columns. Groups run concurrently
+    on a thread pool, or on a process pool where each worker receives the shared layers once.
+
+    Each job is a dictionary with the 'method' ('areal' or 'binary'), 'source' DataFrame and 'cols' to interpolate, and
+    optionally a 'name' (the position of the job by default) and 'suffix'. Binary jobs also take 'exclude_col',
+    'exclude_val' and 'return_geometry' as in :func:`pypolate.binary.binary`.
+
+        >>> runner = BatchRunner(target=block_groups, ancillary=landuse, n_workers=4)
+        >>> for name, result in runner.run(jobs):
+        ...     result.to_parquet(name + '.parquet')
+        >>> runner.report()
+
+    :param target: DataFrame with polygons or grid of cells obtaining interpolated values in areal jobs. The default is None
+    :type target: DataFrame or Grid, optional
+    :param ancillary: Ancillary DataFrame or raster used to mask binary jobs. The default is None
+    :type ancillary: DataFrame or tuple, optional
+    :param n_workers: Number of threads or processes, -1 uses every core. The default is 1
+    :type n_workers: int, optional
+    :param executor: 'thread' or 'process'. Threads share the layers without copying them, and shapely releases the GIL
+        while intersecting. The default is 'thread'
+    :type executor: str, optional
+    """
+
+    def __init__(self, target = None, ancillary = None, n_workers = 1, executor = 'thread'):
+        if executor not in ('thread', 'process'):
+            raise ValueError("executor must be 'thread' or 'process', got {!r}".format(executor))
+        if n_workers == -1:
+            n_workers = os.cpu_count() or 1
+        self.target = target
+        self.ancillary = ancillary
+        self.n_workers = n_workers
+        self.executor = executor
+        self.timings = []
+        self._masks = {}
+
+        #build the spatial index and prepared geometries once, before threads would race to build them
+        if target is not None and not is_grid(target):
+            _prepare(target)
+
+    def run(self, jobs):
+        """
+        Runs jobs and yields their results as soon as they are done. The jobs of a group are yielded together, in the order
+        they were given. The timing of every job is added to ``timings``.
+
+        :param jobs: Job dictionaries
+        :type jobs: list
+
+        :return: Generator of (name, result) tuples
+        :rtype: generator
+        """
+
+        groups = self._groups(jobs)
+        shared = {'target': self.target, 'masks': self._masks}
+        if self.executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=self.n_workers)
+            submit = lambda group: pool.submit(_run_group, shared, group['method'], group['options'], group['jobs'])
+        else:
+            pool = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker, initargs=(shared,))
+            submit = lambda group: pool.submit(_run_group_in_worker, group['method'], group['options'], group['jobs'])
+
+        with pool:
+            futures = {submit(group): number for number, group in enumerate(groups)}
+            for future in as_completed(futures):
+                number = futures[future]
+                group = groups[number]
+                results, shared_seconds = future.result()
+                for name, (result, seconds) in zip(group['names'], results):
+                    #grid results are arrays by column, with one row per cell
+                    rows = len(self.target) if isinstance(result, dict) else len(result)
+                    self.timings.append({'name': name, 'method': group['method'], 'group': number,
+                                         'group_size': len(group['names']), 'shared_seconds': shared_seconds,
+                                         'seconds': seconds, 'rows': rows})
+                    yield name, result
+
+    def report(self):
+        """
+        Returns the timing of every job run so far as a DataFrame, with the name, method, group, number of jobs in the group,
+        seconds spent on the overlay and weights shared by the group, seconds spent on the job's own columns and rows returned, which are the cells for a grid target.
+
+        :rtype: DataFrame
+        """
+
+        return pd.DataFrame(self.timings, columns=REPORT_COLUMNS)
+
+    def _groups(self, jobs):
+        """Groups jobs by method, source geometry and masking options, and masks the ancillary data for binary groups.
+
+        :return: Groups with their method, options, job names and (source, cols, suffix) of every job
+        :rtype: list
+        """
+
+        groups = {}
+        for position, job in enumerate(jobs):
+            method = job['method']
+            if method not in METHODS:
+                raise ValueError("method must be one of {}, got {!r}".format(METHODS, method))
+            if method == 'areal' and self.target is None or method == 'binary' and self.ancillary is None:
+                raise ValueError('{} jobs need a shared {}'.format(method, 'target' if method == 'areal' else 'ancillary'))
+
+            options = ()
+            if method == 'binary':
+                exclude_val = job.get('exclude_val', [None])
+                options = (job.get('exclude_col', ()), tuple(sorted(map(repr, exclude_val))),
+                           job.get('return_geometry', True))
+                self._mask(options[0], exclude_val, options[1])
+
+            digest = hashlib.blake2b(repr((method, options)).encode(), digest_size=20)
+            hash_geometry(digest, job['source'].geometry.to_numpy())
+            group = groups.setdefault(digest.hexdigest(), {'method': method, 'options': options, 'names': [], 'jobs': []})
+            group['names'].append(job.get('name', position))
+            group['jobs'].append((job['source'], list(job['cols']), job.get('suffix', '')))
+        return list(groups.values())
+
+    def _mask(self, exclude_col, exclude_val, mask_key):
+        """Drops excluded classes from the ancillary data once per set of excluded classes and prepares the mask."""
+
+        if (exclude_col, mask_key) in self._masks:
+            return
+        ancillary = self.ancillary
+        if is_raster(ancillary):
+            #rasters are masked after counting pixels, in every group
+            mask = (ancillary, exclude_col, exclude_val)
+        else:
+            if exclude_col:
+                ancillary = ancillary.loc[~ancillary[exclude_col].isin(exclude_val).to_numpy(), [ancillary.geometry.name]]
+            _prepare(ancillary)
+            mask = (ancillary, (), [None])
+        self._masks[(exclude_col, mask_key)] = mask
+
+
+def _run_group(shared, method, options, jobs):
+    """Computes the weights of a group of jobs once and applies them to every job.
+
+    :return: Result and seconds of every job, and seconds spent on the shared weights
+    :rtype: tuple
+    """
+
+    start = time.perf_counter()
+    source = jobs[0][0]
+    if method == 'areal':
+        target = shared['target']
+        weights = areal_weights(source, target)
+        apply = lambda source, cols, suffix: areal_apply(weights, source, target, cols, suffix)
+    else:
+        exclude_col, mask_key, return_geometry = options
+        ancillary, exclude_col, exclude_val = shared['masks'][(exclude_col, mask_key)]
+        ancillary, division, anc_index, areal_wt, geometry = binary_weights(source, ancillary, exclude_col, exclude_val, 1,
+                                                                            None, return_geometry)
+        apply = lambda source, cols, suffix: binary_apply(source, ancillary, division, anc_index, areal_wt, geometry, cols,
+                                                          suffix)
+    shared_seconds = time.perf_counter() - start
+
+    results = []
+    for source, cols, suffix in jobs:
+        start = time.perf_counter()
+        result = apply(source, cols, suffix)
+        results.append((result, time.perf_counter() - start))
+    return results, shared_seconds
+
+
+def _init_worker(shared):
+    """Keeps the shared layers in a worker process and builds their spatial indexes and prepared geometries once, as neither
+    is sent along with the layers."""
+
+    global _worker_shared
+    _worker_shared = shared
+    if shared['target'] is not None and not is_grid(shared['target']):
+        _prepare(shared['target'])
+    for ancillary, _, _ in shared['masks'].values():
+        if not is_raster(ancillary):
+            _prepare(ancillary)
+
+
+def _prepare(layer):
+    """Builds the spatial index of a layer and prepares its geometries for the predicates of every job."""
+
+    layer.sindex
+    shapely.prepare(layer.geometry.to_numpy())
+
+
+def _run_group_in_worker(method, options, jobs):
+    """Runs a group of jobs with the layers shared by the worker process."""
+
+    return _run_group(_worker_shared, method, options, jobs)
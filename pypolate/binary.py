@@ -1,9 +1,15 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 
+from pypolate.operators import fragment_operator
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import profiled, stage
+from pypolate.raster import is_raster, raster_intersect
 
+
+@profiled
 def binary(source, ancillary, exclude_col=(), 
-                  exclude_val= [None], suffix= '', cols= [None]):
+                  exclude_val= [None], suffix= '', cols= [None], n_jobs= 1, backend= None, return_geometry= True,
+                  return_operator= False):
     """This method accepts two DataFrames - a source DataFrame which should contain the values that will be interpolated - and 
     an ancillary DataFrame containing a column with categorical geographic data such as land use types. The function 
     also takes an input called exclusion field which allows the user to pass in the name of the column that contains the categorical data. 
@@ -15,53 +21,126 @@ def binary(source, ancillary, exclude_col=(),
     
     :param source: Name of Dataframe that contains values that should be interpolated
     :type source: str
-    :param ancillary: Name of dataframe containing ancillary geometry data, used to mask source dataframe
-    :type ancillary: str
-    :param exclude_col: Column name from ancillary dataframe that contains exclusionary values
-    :type exclude_col: str
+    :param ancillary: Name of dataframe containing ancillary geometry data, used to mask source dataframe. A raster can be passed instead, as a path to a raster file or a tuple of (array, affine transform, optional nodata), see :func:`pypolate.raster.zonal_class_areas`
+    :type ancillary: str or tuple
+    :param exclude_col: Column name from ancillary dataframe that contains exclusionary values. Leave it out for a mask that is already prepared, see :func:`pypolate.ancillary.prepare_ancillary`
+    :type exclude_col: str, optional
     :param exclude_val: Values from exclude_col that should be removed during binary mask operation
     :type exclude_val: list
     :param suffix: Suffix that should be added to the column names that are interpolated
     :type suffix: str, optional
     :param cols: Column names that should be interpolated
     :type cols: list
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. Without it only intersected areas are calculated and a DataFrame without geometry is returned. The default is True
+    :type return_geometry: bool, optional
+    :param return_operator: Whether to also return the sparse operator from source polygons to intersected polygons, see :func:`pypolate.operators.fragment_operator`. The default is False
+    :type return_operator: bool, optional
     
+    :return: Source dataframe with interpolated columns added. With return_operator, a tuple of the dataframe and the operator
+    :rtype: dataframe or tuple
+    """    
+    ancillary, division, anc_index, areal_wt, geometry = binary_weights(source, ancillary, exclude_col, exclude_val, n_jobs,
+                                                                        backend, return_geometry)
+    output = binary_apply(source, ancillary, division, anc_index, areal_wt, geometry, cols, suffix)
+    if return_operator:
+        return output, fragment_operator(division, areal_wt, len(source))
+    return output
+
+
+@profiled
+def binary_weights(source, ancillary, exclude_col = (), exclude_val = [None], n_jobs = 1, backend = None, return_geometry = True):
+    """
+    Masks the ancillary data and calculates the areal weight of every intersected polygon within its source polygon once, so
+    that they can be reused with :func:`binary_apply` for any number of columns or vintages of source data that share the same
+    geometry.
+
+    :param source: DataFrame with polygons containing values for interpolation
+    :type source: DataFrame
+    :param ancillary: Ancillary DataFrame or raster, as in :func:`binary`
+    :type ancillary: DataFrame or tuple
+    :param exclude_col: Column name from ancillary dataframe that contains exclusionary values. The default is (), for a prepared mask
+    :type exclude_col: str, optional
+    :param exclude_val: Values from exclude_col that should be removed. The default is [None]
+    :type exclude_val: list, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. The default is True
+    :type return_geometry: bool, optional
+
+    :return: Masked ancillary data, and the positional source index, positional ancillary index, areal weight and geometry of each intersected polygon
+    :rtype: tuple
+    """
+
+    if is_raster(ancillary):
+        #count pixels of each class in every source polygon, then drop excluded classes
+        with stage('intersect', len(source)) as record:
+            ancillary, division, anc_index, intersectarea, geometry = raster_intersect(source, ancillary, exclude_col or 'class')
+            kept = ~ancillary[exclude_col or 'class'].isin(exclude_val).to_numpy()
+            division, anc_index, intersectarea = division[kept], anc_index[kept], intersectarea[kept]
+            record.rows_out = len(division)
+    else:
+        #drop excluded rows from ancillary data, keeping only its geometry
+        with stage('mask', len(ancillary)) as record:
+            if exclude_col:
+                binary_mask = ancillary[exclude_col].isin(exclude_val).to_numpy()
+                ancillary = ancillary.loc[~binary_mask, [ancillary.geometry.name]]
+            else:
+                ancillary = ancillary[[ancillary.geometry.name]]
+            record.rows_out = len(ancillary)
+
+        #intersect source file and ancillary file, keeping the position of each source polygon
+        with stage('intersect', len(source)) as record:
+            division, anc_index, intersectarea, geometry = intersect(source, ancillary, n_jobs, backend, return_geometry)
+            record.rows_out = len(division)
+
+    with stage('weights', len(division)) as record:
+        #calculate sum of polygon areas by source polygon
+        masksum = np.bincount(division, weights=intersectarea, minlength=len(source))
+
+        # calculate areal weight of areas
+        areal_wt = intersectarea / masksum[division]
+        record.rows_out = len(areal_wt)
+    return ancillary, division, anc_index, areal_wt, geometry
+
+
+@profiled
+def binary_apply(source, ancillary, division, anc_index, areal_wt, geometry, cols = [None], suffix = ''):
+    """
+    Builds the output of the binary method from the masked ancillary data and areal weights of :func:`binary_weights`, without
+    intersecting again. Only the attribute values of the source are used, so the source can be any DataFrame with the same rows
+    (in the same order) as the one the weights were built from.
+
+    :param source: DataFrame with values for interpolation
+    :type source: DataFrame
+    :param ancillary: Masked ancillary data from :func:`binary_weights`
+    :type ancillary: DataFrame
+    :param division: Positional source index of each intersected polygon
+    :type division: numpy.ndarray
+    :param anc_index: Positional ancillary index of each intersected polygon
+    :type anc_index: numpy.ndarray
+    :param areal_wt: Areal weight of each intersected polygon
+    :type areal_wt: numpy.ndarray
+    :param geometry: Geometry of each intersected polygon, None for a DataFrame without geometry
+    :type geometry: GeometryArray
+    :param cols: Column names that should be interpolated
+    :type cols: list
+    :param suffix: Suffix that should be added to the column names that are interpolated. The default is ''
+    :type suffix: str, optional
+
     :return: Source dataframe with interpolated columns added
     :rtype: dataframe
-    """    
-    # index group 
-    source['division'] = source.index
-           
-    #drop excluded rows from ancillary data
-    binary_mask = ancillary[exclude_col].isin(exclude_val)
-    ancillary = ancillary[~binary_mask]
-    
-    #drop all columns except geometry before join (don't want data from ancillary in final df)
-    ancillary = ancillary[['geometry']]
-          
-    #intersect source file and ancillary file
-    mask = gpd.overlay(source, ancillary, how='intersection')
-    
-    #calculate and store areas of intersected zone
-    mask['intersectarea'] = (mask.area)  
+    """
 
-    #calculate sum of polygon areas by tract
-    masksum = mask.groupby('division')['intersectarea'].sum()
-    
-    # merge summmed areas back to main dataframe
-    target = mask.merge(masksum, on='division')
-    
-    # calculate areal weight of areas
-    target["AREAL_WT"] = target['intersectarea_x'] / target['intersectarea_y']
+    #keep source attributes only (don't want data from ancillary in final df)
+    output = join_fragments(source, ancillary[[]], division, anc_index, geometry)
 
     # loop through columns that user wants to interpolate, add suffix
-    new_cols = []
     for col in cols:
-        new_col = col + suffix
-        new_cols.append(new_col)
-        target[new_col] = target["AREAL_WT"] * target[col]
-    
-    # drop generated columns
-    output = target
-    output = output.drop(['division','intersectarea_x','intersectarea_y', 'AREAL_WT'], axis=1)
-    return output
\ No newline at end of file
+        output[col + suffix] = areal_wt * source[col].to_numpy()[division]
+    return output
@@ -0,0 +1,190 @@
+import contextvars
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import shapely
+
+#overlay cache used in the current context, None when caching is off
+_active = contextvars.ContextVar('pypolate_cache', default=None)
+
+#bump when the layout of cached tables changes so old entries are never read
+CACHE_VERSION = b'1'
+
+class OverlayCache:
+    """
+    Persistent cache of intersection results, shared by every process that points at the same directory. Each entry is a
+    compact table of intersected polygons, with their positional indexes in both inputs, their area and optionally their
+    geometry as WKB, keyed by a hash of the geometry of both inputs. Attribute columns are never cached because the methods
+    join them after intersecting. Entries are Arrow IPC files, memory-mapped when they are read. When the directory grows
+    past max_bytes, the least recently used entries are removed. Requires pyarrow.
+
+    :param path: Directory holding the cache, created if it does not exist
+    :type path: str
+    :param max_bytes: Size budget of the cache in bytes. The default is 1 GiB
+    :type max_bytes: int, optional
+    """
+
+    def __init__(self, path, max_bytes = 2 ** 30):
+        self.path = os.fspath(path)
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, kind, df1, df2):
+        """
+        Hashes the geometry of two DataFrames, in order, into a cache key.
+
+        :param kind: Kind of result, such as 'areas' or 'fragments'
+        :type kind: str
+        :param df1: First DataFrame
+        :type df1: DataFrame
+        :param df2: Second DataFrame
+        :type df2: DataFrame
+
+        :return: Hex digest
+        :rtype: str
+        """
+
+        digest = hashlib.blake2b(CACHE_VERSION + kind.encode(), digest_size=20)
+        for df in (df1, df2):
+            hash_geometry(digest, df.geometry.to_numpy())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Reads a cached table and marks it as recently used.
+
+        :param key: Cache key from :meth:`key`
+        :type key: str
+
+        :return: Columns of the cached table as arrays, None when the key is not cached
+        :rtype: dict
+        """
+
+        import pyarrow as pa
+
+        path = self._file(key)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    def put(self, key, columns):
+        """
+        Writes a table to the cache, then removes the least recently used entries while the cache is over its size budget.
+
+        :param key: Cache key from :meth:`key`
+        :type key: str
+        :param columns: Columns of the table as name=array
+        :type columns: dict
+        """
+
+        import pyarrow as pa
+
+        table = pa.table({name: pa.array(np.asarray(values)) for name, values in columns.items()})
+
+        #write to a temporary file first, so other processes never read a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(temp_path, self._file(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in its size budget. The newest entry is always kept."""
+
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.arrow'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes every entry from the cache."""
+
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.arrow'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _file(self, key):
+        """Returns the path of the file holding a cache entry."""
+
+        return os.path.join(self.path, key + '.arrow')
+
+
+@contextmanager
+def overlay_cache(path, max_bytes = 2 ** 30):
+    """
+    Caches the intersections computed by every method inside the with block in a directory, and reuses them when the same
+    geometries are intersected again, in this process or any other process using the same directory.
+
+        >>> with overlay_cache('/tmp/pypolate') as cache:
+        ...     result = binary(source, ancillary, 'landuse', [8, 9], '_intp', ['pop'])
+
+    :param path: Directory holding the cache, created if it does not exist
+    :type path: str
+    :param max_bytes: Size budget of the cache in bytes. The default is 1 GiB
+    :type max_bytes: int, optional
+
+    :return: Cache in use
+    :rtype: OverlayCache
+    """
+
+    cache = OverlayCache(path, max_bytes)
+    token = _active.set(cache)
+    try:
+        yield cache
+    finally:
+        _active.reset(token)
+
+
+def hash_geometry(digest, geometry):
+    """
+    Adds an array of geometries to a hashlib digest, so equal geometries in the same order always give the same digest.
+
+    :param digest: Digest to update, such as ``hashlib.blake2b()``
+    :type digest: object
+    :param geometry: Geometries
+    :type geometry: numpy.ndarray
+    """
+
+    wkb = shapely.to_wkb(geometry)
+    digest.update(len(wkb).to_bytes(8, 'little'))
+
+    #missing geometries get a byte no WKB starts with
+    digest.update(b''.join([b'\xff' if item is None else item for item in wkb]))
+
+
+def active_cache():
+    """
+    Returns the overlay cache in use, None when caching is off.
+
+    :rtype: OverlayCache
+    """
+
+    return _active.get()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+def class_lookup(class_dicts):
+    """
+    Builds dense lookup arrays from one or more class_dict scenarios, so per-class percentages or thresholds can be assigned to
+    any number of intersected polygons by indexing with integer class codes. Classes are coded in the order they first appear.
+
+    :param class_dicts: Area-class categories with assigned values, one dictionary per scenario
+    :type class_dicts: list
+
+    :return: Index of every class in any scenario, value per class code and scenario (nan for None and for classes missing from a scenario), and whether each class is in each scenario
+    :rtype: tuple
+    """
+
+    classes = pd.Index(list(dict.fromkeys(key for class_dict in class_dicts for key in class_dict)))
+    lookup = np.full((len(classes), len(class_dicts)), np.nan)
+    in_dict = np.zeros((len(classes), len(class_dicts)), dtype=bool)
+    for scenario, class_dict in enumerate(class_dicts):
+        codes = classes.get_indexer(list(class_dict))
+        lookup[codes, scenario] = [np.nan if value is None else value for value in class_dict.values()]
+        in_dict[codes, scenario] = True
+    return classes, lookup, in_dict
+
+
+def code_classes(classes, values, index = None):
+    """
+    Codes class values by their position in classes. The values are factorized once and only their distinct values are looked
+    up in classes, so the cost does not grow with the number of classes.
+
+    :param classes: Classes from :func:`class_lookup`
+    :type classes: pandas.Index
+    :param values: Class of every ancillary polygon
+    :type values: Series or numpy.ndarray
+    :param index: Positional index of the ancillary polygon of every intersected polygon, to code intersected polygons instead. The default is None
+    :type index: numpy.ndarray, optional
+
+    :return: Code of every value, -1 for values that are missing or not in classes
+    :rtype: numpy.ndarray
+    """
+
+    #factorize gives -1 for missing values, which the last lookup entry maps to -1
+    codes, uniques = pd.factorize(values)
+    codes = np.append(classes.get_indexer(uniques), -1)[codes]
+    if index is not None:
+        codes = codes[index]
+    return codes
+
+
+def class_fraction(source_index, intersect_area, class_codes, percents, source_area):
+    """
+    Calculates the fraction of its source polygon's values that every intersected polygon receives in the n-class method, its
+    areal weight times the percentage of its class, divided by the sum of those products in its source polygon.
+
+    :param source_index: Positional index of the source polygon for each intersected polygon
+    :type source_index: numpy.ndarray
+    :param intersect_area: Area of each intersected polygon
+    :type intersect_area: numpy.ndarray
+    :param class_codes: Code of each intersected polygon's class, -1 for classes not in class_dict
+    :type class_codes: numpy.ndarray
+    :param percents: Percentage assigned to each class code, in the floating point type of the result
+    :type percents: numpy.ndarray
+    :param source_area: Area of each source polygon
+    :type source_area: numpy.ndarray
+
+    :return: Fraction for interpolation of each intersected polygon
+    :rtype: numpy.ndarray
+    """
+
+    #assign percentages to landuse classes
+    percent = np.where(class_codes >= 0, percents[class_codes], percents.dtype.type(np.nan))
+
+    #calculate areal weight
+    arealwt = intersect_area / source_area[source_index]
+
+    #multiply areal weight by user defined percentages
+    class_weight = percent * arealwt
+
+    #sum of areal weight times percentage per source polygon
+    temp_sum = np.bincount(source_index, weights=np.where(np.isnan(class_weight), 0, class_weight), minlength=len(source_area))
+    temp_sum = temp_sum.astype(class_weight.dtype, copy=False)
+
+    #fraction for interpolation
+    return class_weight / temp_sum[source_index]
@@ -0,0 +1,264 @@
+import argparse
+import sys
+
+#methods and their modules are imported by the command that runs them, so --help does not load geopandas
+RASTER_SUFFIXES = ('.tif', '.tiff', '.vrt', '.img')
+OUTPUT_SUFFIXES = ('.parquet', '.geoparquet', '.gpkg')
+
+def main(argv = None):
+    """
+    Runs one interpolation method on layers read from files and writes its result to a GeoParquet file or a GeoPackage.
+    Inputs can be GeoParquet files or any file pyogrio reads, and only the columns the method needs are read. Installed as
+    the ``pypolate`` command.
+
+        $ pypolate areal taz.parquet block_groups.gpkg --cols crashes --suffix _intp -o crashes.parquet --profile
+
+    :param argv: Command line arguments. The default is None, which uses sys.argv
+    :type argv: list, optional
+
+    :return: Exit status
+    :rtype: int
+    """
+
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if not str(args.output).lower().endswith(OUTPUT_SUFFIXES):
+        parser.error('output must be a .parquet, .geoparquet or .gpkg file')
+    if str(args.output).lower().endswith('.gpkg'):
+        if getattr(args, 'no_geometry', False):
+            parser.error('--no-geometry output can only be written to GeoParquet')
+        if str(getattr(args, 'ancillary', '')).lower().endswith(RASTER_SUFFIXES):
+            parser.error('output of a raster ancillary has no geometry and can only be written to GeoParquet')
+
+    if not args.profile:
+        _run(args)
+        return 0
+
+    from pypolate.profiling import profile
+
+    with profile(memory=False) as profiler:
+        _run(args)
+    print(profiler.report()[['path', 'seconds', 'rows_in', 'rows_out']].to_string(index=False), file=sys.stderr)
+    return 0
+
+
+def _parser():
+    """Builds the argument parser with one subcommand per method."""
+
+    parser = argparse.ArgumentParser(prog='pypolate', description='Spatial interpolation of vector data.')
+    methods = parser.add_subparsers(dest='method', metavar='method', required=True)
+
+    #options shared by every method
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-o', '--output', required=True, help='output .parquet (GeoParquet) or .gpkg file')
+    common.add_argument('--n-jobs', type=int, default=1, help='processes for the overlay, -1 uses every core (default 1)')
+    common.add_argument('--backend', choices=['geopandas', 'tiled'], help="overlay backend (default 'tiled' when --n-jobs is not 1)")
+    common.add_argument('--profile', action='store_true', help='print the time spent in every stage to stderr')
+    keep = argparse.ArgumentParser(add_help=False)
+    keep.add_argument('--keep', nargs='+', metavar='COL', help='attribute columns carried into the output (default all)')
+    no_geometry = argparse.ArgumentParser(add_help=False)
+    no_geometry.add_argument('--no-geometry', action='store_true', help='only calculate areas, without output geometry')
+
+    command = methods.add_parser('areal', parents=[common, keep], help='areal weighting',
+                                 description='Areal weighting of source values into target polygons.')
+    command.add_argument('source', help='layer with values to interpolate')
+    command.add_argument('target', help='layer with polygons obtaining interpolated values, --keep selects its columns')
+    command.add_argument('--cols', nargs='+', required=True, help='source columns to interpolate')
+    command.add_argument('--suffix', default='', help='suffix for interpolated columns')
+    command.set_defaults(func=_areal)
+
+    command = methods.add_parser('binary', parents=[common, keep, no_geometry], help='binary dasymetric mask',
+                                 description='Binary dasymetric mapping with classes of an ancillary layer masked out.')
+    command.add_argument('source', help='layer with values to interpolate, --keep selects its columns')
+    command.add_argument('ancillary', help='ancillary layer or classified raster')
+    command.add_argument('--cols', nargs='+', required=True, help='source columns to interpolate')
+    command.add_argument('--exclude-col', help='ancillary column with the classes to exclude, leave out for a prepared mask')
+    command.add_argument('--exclude-val', nargs='+', default=[], help='classes to exclude')
+    command.add_argument('--suffix', default='', help='suffix for interpolated columns')
+    command.set_defaults(func=_binary)
+
+    for name, alias, title, value in [('lim_var', 'lim-var', 'limiting variable', 'maximum value per square unit'),
+                                      ('n_class', 'n-class', 'n-class', 'share of the source value')]:
+        command = methods.add_parser(name, aliases=[alias], parents=[common, no_geometry], help=title,
+                                     description='The {} method with classes of an ancillary layer.'.format(title))
+        command.add_argument('source', help='layer with values to interpolate')
+        command.add_argument('ancillary', help='ancillary layer or classified raster')
+        command.add_argument('--class-col', required=True, help='ancillary column with area classes')
+        command.add_argument('--classes', required=True, metavar='JSON',
+                             help='JSON object of class to {}, such as \'{{"1": 0.7, "2": 0.3}}\''.format(value))
+        command.add_argument('--cols', nargs='+', required=True, help='source columns to interpolate')
+        command.add_argument('--source-identifier', default='', help='source column identifying source polygons')
+        command.add_argument('--suffix', default='', help='suffix for interpolated columns')
+        command.add_argument('--dtype', choices=['float64', 'float32'], default='float64', help='floating point type of values')
+        command.set_defaults(func=_lim_var if name == 'lim_var' else _n_class)
+
+    for name, title in [('parcel', 'parcel based method'), ('expert', 'cadastral-based expert dasymetric system')]:
+        command = methods.add_parser(name, parents=[common, keep, no_geometry], help=title,
+                                     description='The {}.'.format(title))
+        if name == 'expert':
+            command.add_argument('large_zone', help='larger zones, or a comma separated chain from smallest to largest')
+            command.add_argument('small_zone', help='smaller zones nesting in the larger zones')
+        else:
+            command.add_argument('zone', help='zones with values to disaggregate')
+        command.add_argument('parcel', help='parcel layer, --keep selects its columns')
+        for column, text in [('tu', 'total units'), ('ru', 'residential units'), ('ba', 'building area'),
+                             ('ra', 'residential area')]:
+            command.add_argument('--{}-col'.format(column), required=True, help='parcel column with {}'.format(text))
+        if name == 'expert':
+            command.add_argument('--intp-col', required=True, help='zone column to disaggregate')
+        else:
+            command.add_argument('--cols', nargs='+', required=True, help='zone columns to disaggregate')
+        command.add_argument('--assignment', choices=['overlay', 'point', 'largest'], default='overlay',
+                             help="how parcels are matched to zones (default 'overlay')")
+        command.set_defaults(func=_parcel if name == 'parcel' else _expert)
+
+    return parser
+
+
+def _run(args):
+    """Runs the method of the parsed arguments and writes its result."""
+
+    from pypolate.profiling import stage
+
+    result = args.func(args)
+    with stage('write', len(result)) as record:
+        if str(args.output).lower().endswith('.gpkg'):
+            result.to_file(args.output, driver='GPKG', engine='pyogrio')
+        else:
+            result.to_parquet(args.output)
+        record.rows_out = len(result)
+
+
+def _areal(args):
+    """Reads the layers of the areal command and runs it."""
+
+    from pypolate.areal import areal
+
+    source = _read(args.source, args.cols)
+    target = _read(args.target, args.keep)
+    return areal(source, target, args.cols, args.suffix, args.n_jobs, args.backend)
+
+
+def _binary(args):
+    """Reads the layers of the binary command and runs it."""
+
+    from pypolate.binary import binary
+
+    source = _read(args.source, _carried(args.cols, args.keep))
+    ancillary = _read_ancillary(args.ancillary, [args.exclude_col] if args.exclude_col else [])
+    exclude_val = _typed(args.exclude_val, ancillary, args.exclude_col)
+    return binary(source, ancillary, args.exclude_col or (), exclude_val, args.suffix, args.cols, args.n_jobs, args.backend,
+                  not args.no_geometry)
+
+
+def _lim_var(args):
+    """Reads the layers of the lim_var command and runs it."""
+
+    from pypolate.lim_var import lim_var
+
+    return lim_var(*_class_inputs(args), args.cols, args.source_identifier, args.suffix, args.n_jobs, args.backend,
+                   not args.no_geometry, args.dtype)
+
+
+def _n_class(args):
+    """Reads the layers of the n_class command and runs it."""
+
+    from pypolate.n_class import n_class
+
+    return n_class(*_class_inputs(args), args.cols, args.source_identifier, args.suffix, args.n_jobs, args.backend,
+                   not args.no_geometry, args.dtype)
+
+
+def _parcel(args):
+    """Reads the layers of the parcel command and runs it."""
+
+    from pypolate.parcel import parcel
+
+    zone = _read(args.zone, args.cols)
+    parcels = _read(args.parcel, _carried([args.tu_col, args.ru_col, args.ba_col, args.ra_col], args.keep))
+    return parcel(zone, parcels, args.tu_col, args.ru_col, args.ba_col, args.ra_col, args.cols, args.assignment, args.n_jobs,
+                  args.backend, not args.no_geometry)
+
+
+def _expert(args):
+    """Reads the layers of the expert command and runs it."""
+
+    from pypolate.expert import expert
+
+    large_zone = [_read(path, [args.intp_col]) for path in args.large_zone.split(',')]
+    small_zone = _read(args.small_zone, [args.intp_col])
+    parcels = _read(args.parcel, _carried([args.tu_col, args.ru_col, args.ba_col, args.ra_col], args.keep))
+    return expert(large_zone if len(large_zone) > 1 else large_zone[0], small_zone, parcels, args.tu_col, args.ru_col,
+                  args.ba_col, args.ra_col, args.intp_col, args.assignment, args.n_jobs, args.backend, not args.no_geometry)
+
+
+def _class_inputs(args):
+    """Reads the source and ancillary layers and the class_dict of a class based method.
+
+    :return: Source, ancillary, class column and class_dict
+    :rtype: tuple
+    """
+
+    import json
+
+    source = _read(args.source, _carried(args.cols, [args.source_identifier] if args.source_identifier else []))
+    ancillary = _read_ancillary(args.ancillary, [args.class_col])
+    classes = json.loads(args.classes)
+    class_dict = dict(zip(_typed(list(classes), ancillary, args.class_col), classes.values()))
+    return source, ancillary, args.class_col, class_dict
+
+
+def _read(path, columns):
+    """Reads a layer with only the given attribute columns, None reads every column."""
+
+    from pypolate.io import read_layer
+    from pypolate.profiling import stage
+
+    with stage('read', None) as record:
+        layer = read_layer(path, columns)
+        record.rows_out = len(layer)
+    return layer
+
+
+def _read_ancillary(path, columns):
+    """Reads an ancillary layer, or keeps the path of a classified raster for the method to read."""
+
+    if str(path).lower().endswith(RASTER_SUFFIXES):
+        return path
+    return _read(path, columns)
+
+
+def _carried(cols, keep):
+    """Returns the columns to read from a layer whose attributes are carried into the output, None for every column."""
+
+    if keep is None:
+        return None
+    return list(dict.fromkeys([*keep, *cols]))
+
+
+def _typed(values, ancillary, column):
+    """Converts class values given as text to the values of an ancillary column, or to numbers for raster classes.
+
+    :return: Class values
+    :rtype: list
+    """
+
+    if isinstance(ancillary, str):
+        return [_number(value) for value in values]
+    lookup = {str(value): value for value in ancillary[column].dropna().unique()} if column else {}
+    return [lookup.get(value, value) for value in values]
+
+
+def _number(value):
+    """Converts text to an int or float when it is one."""
+
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+if __name__ == '__main__':
+    sys.exit(main())
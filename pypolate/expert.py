@@ -1,22 +1,27 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 
-def expert(large_zone, small_zone, parcel, tu_col, ru_col, ba_col, ra_col, intp_col):
+from pypolate.operators import fragment_operator, grouping_operator
+from pypolate.parcel import derive_parcels, match_parcels, zone_sum
+from pypolate.profiling import profiled, stage
+
+@profiled
+def expert(large_zone, small_zone, parcel, tu_col, ru_col, ba_col, ra_col, intp_col, assignment = 'overlay', n_jobs = 1, backend = None, return_geometry = True, return_operator = False):
         
     """The CEDS method works in conjunction with the parcel based method to determine whether adjusted residential area or number of residential 
     units are a more accurate determinant when disaggregating population. The CEDS method accepts three DataFrames, two zone DataFrames that must 
     nest with each other and contain geometry and population, and a parcel DataFrame that contains geometry, total units per parcel, residential units per parcel, 
-    building area per parcel, and residential area per parcel. The parcel based method is called twice inside the CEDS method, once using the larger zone DataFrame as an 
-    input, and once using the smaller nested zone DataFrame as an input to the parcel method. The populations at the tax lot level that were derived from the large zone 
-    are then reaggregated back up to the small zone level. The absolute value of the difference between the large zone based populations and small zone estimated population 
+    building area per parcel, and residential area per parcel. Parcels are matched to the smaller zone once, and the parcel based method is applied at the small zone level. 
+    Each small zone is placed in the larger zone it nests in, and the populations that the parcel based method would derive from the large zone 
+    are reaggregated to the small zone level with a sparse regrouping operator instead of another overlay. The absolute value of the difference between the large zone based populations and small zone estimated population 
     are then calculated. Finally, for each parcel, if the absolute difference between the large zone based population and the small zone estimated population based 
     on residential units is less than or equal to the absolute difference between the large zone population and small zone estimated population based on adjusted residential area, 
     then the population estimate from the small zone based on residential units is determined to be the more accurate disaggregation. Otherwise, the 
     population estimate from the small zone based on adjusted residential area is determined by the CEDS method to be the more accurate measure of disaggregation. 
     This method returns one DataFrame at the tax lot level with the parcel based method calculations, plus an additional column that contains the selected outcome of the CEDS method.
     
-    :param large_zone: DataFrame with larger geography
-    :type large_zone: Dataframe
+    :param large_zone: DataFrame with larger geography. A list of DataFrames can be passed for a chain of more than two nested levels (block group, tract),
+        ordered from smallest to largest. The absolute differences from every larger level are added up before choosing between RU and ara
+    :type large_zone: Dataframe or list
     :param small_zone: DataFrame with smaller geography
     :type small_zone: Dataframe
     :param parcel: Parcel DataFrame
@@ -31,40 +36,84 @@ def expert(large_zone, small_zone, parcel, tu_col, ru_col, ba_col, ra_col, intp_
     :type ra_col: string
     :param intp_col: Column name from Zone DataFrame containing values to interpolate. Only accepts one column
     :type intp_col: str
+    :param assignment: How parcels are matched to the small zone, 'overlay', 'point' or 'largest'. See :func:`pypolate.parcel.parcel`. The default is 'overlay'
+    :type assignment: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected parcels when assignment is 'overlay'. Without it a DataFrame without geometry is returned. The default is True
+    :type return_geometry: bool, optional
+    :param return_operator: Whether to also return the sparse operator from small zones to matched parcels that gives the expert system column, see :func:`pypolate.operators.fragment_operator`. Each parcel takes the RU or ara share chosen from the values of intp_col. The default is False
+    :type return_operator: bool, optional
     
-    :return: Dataframe at parcel level containing interpolated values based on expert system implementation
-    :rtype: DataFrame
+    :return: Dataframe at parcel level containing interpolated values based on expert system implementation. With return_operator, a tuple of the DataFrame and the operator
+    :rtype: DataFrame or tuple
     """    
     
-    # index small_zone
-    small_zone['index_s'] = small_zone.index
-    
-    # call parcel method on large interpolation zone
-    expert_large = parcel_method(large_zone, parcel, tu_col, ru_col, ba_col, ra_col, [intp_col])    
-    # call parcel method on small interpolation zone
-    expert_small = parcel_method(small_zone, parcel, tu_col, ru_col, ba_col, ra_col, [intp_col])
-       
-    # overlay the interpolated large zone with small zone, so that it can later by grouped by small zone index
-    expert = gpd.overlay(expert_large, small_zone, how='intersection')
-    
-    # sum ara at small zone level
-    expert_ara = expert.groupby('index_s')['ara_derived_' + intp_col].sum().reset_index(name='expert_ara')    
-    # sum ru at small zone level
-    expert_ru = expert.groupby('index_s')['ru_derived_' + intp_col].sum().reset_index(name='expert_ru')
-    
-    # merge ru and ara into same dataframe
-    expert_parcel = expert_ara.merge(expert_ru, on = 'index_s')
-    
-    # pop diff calculation
-    expert_parcel['ara_diff'] = abs(expert_small[intp_col] - expert_parcel['expert_ara'])
-    expert_parcel['ru_diff'] = abs(expert_small[intp_col] - expert_parcel['expert_ru'])
-    
-    # merge the aggregated data back with the small zone interpolated parcel dataframe
-    expert_parcel = expert_small.merge(expert_parcel, on='index_s')
-    
+    # larger levels of the nesting chain, smallest first
+    if isinstance(large_zone, (list, tuple)):
+        levels = list(large_zone)
+    else:
+        levels = [large_zone]
+
+    # match parcels to the small zone once and calculate small zone based populations
+    expert_parcel, small_index, ru, ara = match_parcels(small_zone, parcel, tu_col, ru_col, ba_col, ra_col, assignment,
+                                                        n_jobs, backend, return_geometry)
+    ru_share, ara_share = derive_parcels(expert_parcel, small_zone, [intp_col], small_index, ru, ara)
+
+    # sum RU and ara at small zone level
+    ru_small = zone_sum(small_index, ru, len(small_zone))
+    ara_small = zone_sum(small_index, ara, len(small_zone))
+    small_value = small_zone[intp_col].to_numpy(dtype=float)
+
+    ru_diff = np.zeros(len(small_zone))
+    ara_diff = np.zeros(len(small_zone))
+    for level in levels:
+        with stage('regroup', len(small_zone)) as record:
+            # find the large zone each small zone nests in, and sum RU and ara at large zone level
+            nest = _nest(small_zone, level)
+            nested = nest >= 0
+            grouping = grouping_operator(nest, len(level))
+            ru_large = grouping @ ru_small
+            ara_large = grouping @ ara_small
+
+            # large zone based populations regrouped to small zone level, with one operator product each
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ru_regroup = grouping_operator(nest, len(level), ru_small / ru_large[nest]).T
+                ara_regroup = grouping_operator(nest, len(level), ara_small / ara_large[nest]).T
+            large_value = level[intp_col].to_numpy(dtype=float)
+            expert_ru = np.where(nested, ru_regroup @ large_value, np.nan)
+            expert_ara = np.where(nested, ara_regroup @ large_value, np.nan)
+
+            # pop diff calculation
+            ru_diff = ru_diff + abs(small_value - expert_ru)
+            ara_diff = ara_diff + abs(small_value - expert_ara)
+            record.rows_out = int(nested.sum())
+
     # apply the expert system
-    expert_parcel['expert_system_interpolation'] = expert_parcel.apply(lambda x: x['ru_derived_' + intp_col] 
-                                                           if x['ru_diff']<=x['ara_diff']
-                                                           else x['ara_derived_' + intp_col], axis=1)
-    expert_parcel.drop(['index_s', 'expert_ara', 'expert_ru', 'ara_diff', 'ru_diff'], axis=1, inplace = True)
+    use_ru = (ru_diff <= ara_diff)[small_index]
+    expert_parcel['expert_system_interpolation'] = np.where(use_ru, expert_parcel['ru_derived_' + intp_col],
+                                                            expert_parcel['ara_derived_' + intp_col])
+    if return_operator:
+        return expert_parcel, fragment_operator(small_index, np.where(use_ru, ru_share, ara_share), len(small_zone))
     return expert_parcel
+
+
+def _nest(small_zone, large_zone):
+    """Finds the large zone that each small zone nests in, using the representative point of each small zone.
+
+    :param small_zone: DataFrame with smaller geography
+    :type small_zone: DataFrame
+    :param large_zone: DataFrame with larger geography
+    :type large_zone: DataFrame
+
+    :return: Positional index of the large zone for each small zone, -1 for small zones outside every large zone
+    :rtype: numpy.ndarray
+    """
+
+    small_index, large_index = large_zone.sindex.query(small_zone.geometry.representative_point().values, predicate='intersects')
+    small_index, first = np.unique(small_index, return_index=True)
+    nest = np.full(len(small_zone), -1)
+    nest[small_index] = large_index[first]
+    return nest
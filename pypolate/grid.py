@@ -0,0 +1,243 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from scipy import sparse
+
+from pypolate.overlay import make_valid
+from pypolate.profiling import stage
+
+class Grid:
+    """
+    Regular north-up grid of rectangular cells, accepted as the target of :func:`pypolate.areal.areal` and
+    :func:`pypolate.n_class.n_class`. Cells are numbered row by row from the upper left corner, and interpolated values are
+    returned as 2-D arrays of shape ``grid.shape`` instead of a DataFrame of cell polygons. Cell polygons are only built on
+    request with :meth:`polygons`.
+
+    :param origin: Coordinates (x, y) of the upper left corner of the grid
+    :type origin: tuple
+    :param cell_size: Width of the cells, or their (width, height)
+    :type cell_size: float or tuple
+    :param shape: Number of (rows, columns)
+    :type shape: tuple
+    :param crs: Coordinate reference system of the grid. The default is None
+    :type crs: object, optional
+    """
+
+    def __init__(self, origin, cell_size, shape, crs = None):
+        width, height = cell_size if np.ndim(cell_size) else (cell_size, cell_size)
+        if width <= 0 or height <= 0:
+            raise ValueError('cell_size must be positive, got {!r}'.format(cell_size))
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.cell_size = (float(width), float(height))
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.crs = crs
+
+    @classmethod
+    def from_bounds(cls, bounds, cell_size, crs = None):
+        """
+        Builds the grid of cells of a given size covering bounds, starting at their upper left corner.
+
+        :param bounds: Bounds (minx, miny, maxx, maxy), such as ``df.total_bounds``
+        :type bounds: tuple
+        :param cell_size: Width of the cells, or their (width, height)
+        :type cell_size: float or tuple
+        :param crs: Coordinate reference system of the grid. The default is None
+        :type crs: object, optional
+
+        :rtype: Grid
+        """
+
+        minx, miny, maxx, maxy = bounds
+        width, height = cell_size if np.ndim(cell_size) else (cell_size, cell_size)
+        shape = (max(int(np.ceil((maxy - miny) / height)), 1), max(int(np.ceil((maxx - minx) / width)), 1))
+        return cls((minx, maxy), (width, height), shape, crs)
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    def __repr__(self):
+        return 'Grid(origin={}, cell_size={}, shape={})'.format(self.origin, self.cell_size, self.shape)
+
+    @property
+    def bounds(self):
+        """Bounds (minx, miny, maxx, maxy) of the grid."""
+
+        (x0, y0), (width, height), (n_rows, n_cols) = self.origin, self.cell_size, self.shape
+        return (x0, y0 - n_rows * height, x0 + n_cols * width, y0)
+
+    @property
+    def transform(self):
+        """Affine transform (a, b, c, d, e, f) from (column, row) to (x, y), as used by rasters."""
+
+        (x0, y0), (width, height) = self.origin, self.cell_size
+        return (width, 0.0, x0, 0.0, -height, y0)
+
+    def coords(self):
+        """
+        Returns the coordinates of the cell centers, for building labelled arrays such as an ``xarray.Dataset``.
+
+        :return: x of every column and y of every row
+        :rtype: tuple
+        """
+
+        (x0, y0), (width, height), (n_rows, n_cols) = self.origin, self.cell_size, self.shape
+        return x0 + (np.arange(n_cols) + 0.5) * width, y0 - (np.arange(n_rows) + 0.5) * height
+
+    def polygons(self, values = None):
+        """
+        Builds the cell polygons, with their 'row' and 'col'. With values, the arrays are added as columns and only cells
+        with a value are kept, like the DataFrame :func:`pypolate.areal.areal` returns for polygon targets.
+
+        :param values: 2-D arrays of shape ``grid.shape`` by column name, such as the result of interpolating onto the grid. The default is None
+        :type values: dict, optional
+
+        :return: DataFrame with one row per cell
+        :rtype: GeoDataFrame
+        """
+
+        (x0, y0), (width, height), n_cols = self.origin, self.cell_size, self.shape[1]
+        cells = np.arange(len(self))
+        if values:
+            cells = cells[~np.all([np.isnan(np.ravel(array)) for array in values.values()], axis=0)]
+        row, col = np.divmod(cells, n_cols)
+        frame = {'row': row, 'col': col}
+        for name, array in (values or {}).items():
+            frame[name] = np.ravel(array)[cells]
+        geometry = shapely.box(x0 + col * width, y0 - (row + 1) * height, x0 + (col + 1) * width, y0 - row * height)
+        return gpd.GeoDataFrame(frame, geometry=geometry, crs=self.crs)
+
+
+def is_grid(target):
+    """
+    Returns whether a target is a :class:`Grid`.
+
+    :param target: Target input
+    :type target: DataFrame or Grid
+
+    :rtype: bool
+    """
+
+    return isinstance(target, Grid)
+
+
+def cell_areas(geometry, grid):
+    """
+    Calculates the area of every polygon inside every grid cell without building cell polygons or running an overlay. Every
+    ring edge is split where it crosses grid lines, and by Green's theorem the area of a polygon inside a cell is the sum of
+    the integrals of its clipped edge pieces across the cell's column, so each cell gets the integral of the pieces inside it
+    plus the width of the pieces below it in its column. The areas are exact up to floating point error, for any polygon,
+    including holes and multipolygons.
+
+    :param geometry: Polygons
+    :type geometry: numpy.ndarray or GeoSeries
+    :param grid: Grid to intersect with
+    :type grid: Grid
+
+    :return: Sparse matrix of intersected areas with one row per polygon and one column per cell
+    :rtype: scipy.sparse.csr_matrix
+    """
+
+    (x0, y0), (width, height), (n_rows, n_cols) = grid.origin, grid.cell_size, grid.shape
+    geometry = make_valid(np.asarray(geometry))
+
+    with stage('cells', len(geometry)) as record:
+        #rings of every polygon part in grid units, columns to the right and rows downwards
+        parts, part_index = shapely.get_parts(geometry, return_index=True)
+        rings, ring_part = shapely.get_rings(parts, return_index=True)
+        coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+        u = (coords[:, 0] - x0) / width
+        v = (y0 - coords[:, 1]) / height
+
+        #sign that makes every exterior ring count positive and every hole negative
+        exterior = np.r_[True, ring_part[1:] != ring_part[:-1]] if len(rings) else np.zeros(0, dtype=bool)
+        edge = np.flatnonzero(ring_index[1:] == ring_index[:-1])
+        ring_area = np.bincount(ring_index[edge], weights=u[edge] * v[edge + 1] - u[edge + 1] * v[edge], minlength=len(rings))
+        ring_sign = np.where(exterior == (ring_area > 0), -1.0, 1.0)
+
+        #block of cells under the bounding box of every polygon, in grid units
+        geom_index = part_index[ring_part]
+        bounds = shapely.bounds(geometry)
+        empty = np.isnan(bounds[:, 0])
+        bounds[empty] = (x0, y0, x0, y0)
+        col0 = np.clip(np.floor((bounds[:, 0] - x0) / width), 0, n_cols).astype(np.int64)
+        col1 = np.clip(np.ceil((bounds[:, 2] - x0) / width), 0, n_cols).astype(np.int64)
+        row0 = np.clip(np.floor((y0 - bounds[:, 3]) / height), 0, n_rows).astype(np.int64)
+        row1 = np.clip(np.ceil((y0 - bounds[:, 1]) / height), 0, n_rows).astype(np.int64)
+        block_rows = row1 - row0
+        block_start = np.r_[0, np.cumsum(block_rows * (col1 - col0))]
+
+        u0, u1, v0, v1 = u[edge], u[edge + 1], v[edge], v[edge + 1]
+        pieces = _split_edges(u0, u1, v0, v1, n_rows, n_cols)
+        piece_edge, piece_u0, piece_u1, piece_v0, piece_v1 = pieces
+
+        #keep pieces inside the grid columns, and clamp rows to the grid, where pieces above or below it act the same
+        du = piece_u1 - piece_u0
+        col = np.floor((piece_u0 + piece_u1) / 2).astype(np.int64)
+        vmid = np.clip((piece_v0 + piece_v1) / 2, 0, n_rows)
+        row = np.floor(vmid).astype(np.int64)
+        ring = ring_index[edge][piece_edge]
+        geom = geom_index[ring]
+        kept = (du != 0) & (col >= col0[geom]) & (col < col1[geom]) & (block_rows[geom] > 0)
+        du, col, vmid, row, ring, geom = du[kept], col[kept], vmid[kept], row[kept], ring[kept], geom[kept]
+        du = du * ring_sign[ring]
+
+        #each column of a block is contiguous, so running sums down a column never mix columns
+        column_start = block_start[geom] + (col - col0[geom]) * block_rows[geom]
+        inside = row < row1[geom]
+        total = np.bincount(column_start[inside] + row[inside] - row0[geom[inside]],
+                            weights=du[inside] * (vmid[inside] - row[inside]), minlength=block_start[-1])
+
+        #pieces add their width to every cell above them in their column
+        above = np.bincount(column_start, weights=du, minlength=block_start[-1])
+        above -= np.bincount(column_start[inside] + row[inside] - row0[geom[inside]], weights=du[inside],
+                             minlength=block_start[-1])
+        running = np.cumsum(above)
+        column_length = np.repeat(block_rows, col1 - col0)
+        starts = np.r_[0, np.cumsum(column_length)][:-1]
+        running -= np.repeat(np.r_[0, running][starts], column_length)
+        area = (total + running) * (width * height)
+
+        #cell of every block entry
+        block_geom = np.repeat(np.arange(len(geometry)), block_start[1:] - block_start[:-1])
+        offset = np.arange(block_start[-1]) - block_start[block_geom]
+        block_col, block_row = np.divmod(offset, np.maximum(block_rows[block_geom], 1))
+        cell = (row0[block_geom] + block_row) * n_cols + col0[block_geom] + block_col
+
+        #drop cells a polygon does not reach, where only rounding error is left
+        hit = area > 1e-9 * width * height
+        areas = sparse.csr_matrix((area[hit], (block_geom[hit], cell[hit])), shape=(len(geometry), len(grid)))
+        record.rows_out = areas.nnz
+    return areas
+
+
+def _split_edges(u0, u1, v0, v1, n_rows, n_cols):
+    """Splits edges where they cross the grid lines inside the grid, including its outer lines, in grid units.
+
+    :return: Edge of every piece, and the coordinates of its start and end
+    :rtype: tuple
+    """
+
+    #grid lines each edge crosses, as fractions along the edge
+    splits = [(np.arange(len(u0)), np.zeros(len(u0))), (np.arange(len(u0)), np.ones(len(u0)))]
+    for a0, a1, n_lines in ((u0, u1, n_cols), (v0, v1, n_rows)):
+        first = np.clip(np.ceil(np.minimum(a0, a1)), 0, n_lines + 1).astype(np.int64)
+        last = np.clip(np.floor(np.maximum(a0, a1)), -1, n_lines).astype(np.int64)
+        #edges running along a grid line do not cross it
+        count = np.where(a0 != a1, np.maximum(last - first + 1, 0), 0)
+        crossing_edge = np.repeat(np.arange(len(a0)), count)
+        line = first[crossing_edge] + np.arange(count.sum()) - np.repeat(np.r_[0, np.cumsum(count)][:-1], count)
+        delta = (a1 - a0)[crossing_edge]
+        splits.append((crossing_edge, (line - a0[crossing_edge]) / delta))
+
+    split_edge = np.concatenate([edge for edge, _ in splits])
+    fraction = np.clip(np.concatenate([fraction for _, fraction in splits]), 0, 1)
+    order = np.lexsort((fraction, split_edge))
+    split_edge, fraction = split_edge[order], fraction[order]
+
+    #consecutive splits of the same edge bound one piece
+    same = np.flatnonzero(split_edge[1:] == split_edge[:-1])
+    piece_edge = split_edge[same]
+    t0, t1 = fraction[same], fraction[same + 1]
+    du, dv = (u1 - u0)[piece_edge], (v1 - v0)[piece_edge]
+    return (piece_edge, u0[piece_edge] + t0 * du, u0[piece_edge] + t1 * du, v0[piece_edge] + t0 * dv,
+            v0[piece_edge] + t1 * dv)
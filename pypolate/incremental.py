@@ -0,0 +1,250 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from pypolate.areal import areal_weights
+from pypolate.classes import class_fraction, class_lookup, code_classes
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import stage
+from pypolate.raster import is_raster, raster_intersect
+
+class IncrementalAreal:
+    """
+    Areal weighting that keeps its areal weights and interpolated totals between runs, so that updates to a few source
+    polygons only touch the target polygons they overlap. Value changes are applied as the difference between the new and old
+    values times the stored weights. Geometry changes intersect only the changed source polygons with the target again and
+    replace their rows of the weight matrix. See :func:`pypolate.areal.areal`.
+
+    :param source: DataFrame with values for interpolation.
+    :type source: DataFrame
+    :param target: DataFrame with polygons obtaining interpolated values.
+    :type target: DataFrame
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    """
+
+    def __init__(self, source, target, cols = [None], suffix = '', n_jobs = 1, backend = None):
+        self.cols = list(cols)
+        self.new_cols = [col + suffix for col in cols]
+        self.target = target
+        self.n_jobs = n_jobs
+        self.backend = backend
+
+        self.source_index = source.index
+        self.values = np.array(source[self.cols], dtype=float)
+        self.weights = areal_weights(source, target, n_jobs, backend)
+        self.totals = self.weights.T @ self.values
+
+        #number of source polygons overlapping each target polygon
+        self.overlaps = np.bincount(self.weights.indices, minlength=len(target))
+
+    def result(self):
+        """
+        Returns the target polygons that receive interpolated values, as :func:`pypolate.areal.areal` does, except that the
+        index of the target DataFrame is kept so rows can be matched with the output of :meth:`update`.
+
+        :return: Target DataFrame with interpolated columns added
+        :rtype: DataFrame
+        """
+
+        final = self.target[self.overlaps > 0].copy()
+        final[self.new_cols] = self.totals[self.overlaps > 0]
+        return final
+
+    def update(self, changes):
+        """
+        Applies changes to existing source polygons and updates the interpolated values of the target polygons they overlap,
+        before or after the change.
+
+        :param changes: DataFrame indexed like the source, holding the rows that changed and any of the interpolated columns that changed. A GeoDataFrame also replaces the geometry of those rows
+        :type changes: DataFrame
+
+        :return: Target rows whose interpolated values changed, for upserting, and the index of target rows that no longer receive any values
+        :rtype: tuple
+        """
+
+        positions = self.source_index.get_indexer(changes.index)
+        if (positions < 0).any():
+            raise KeyError('changes hold rows that are not in the source: {}'.format(list(changes.index[positions < 0])))
+
+        old_weights = self.weights[positions]
+        old_values = self.values[positions]
+
+        #new values of the changed rows
+        new_values = old_values.copy()
+        for i, col in enumerate(self.cols):
+            if col in changes.columns:
+                new_values[:, i] = changes[col].to_numpy(dtype=float)
+        self.values[positions] = new_values
+
+        #new weights of the changed rows, intersecting only changed geometries
+        if isinstance(changes, gpd.GeoDataFrame):
+            with stage('reweight', len(changes)) as record:
+                new_weights = areal_weights(changes, self.target, self.n_jobs, self.backend)
+                moved = sparse.csr_matrix((np.ones(len(positions)), (positions, np.arange(len(positions)))),
+                                          shape=(len(self.source_index), len(positions)))
+                kept = sparse.diags(np.isin(np.arange(len(self.source_index)), positions, invert=True).astype(float))
+                self.weights = sparse.csr_matrix(kept @ self.weights + moved @ new_weights)
+                self.weights.eliminate_zeros()
+                self.overlaps = (self.overlaps - np.bincount(old_weights.indices, minlength=len(self.target))
+                                 + np.bincount(new_weights.indices, minlength=len(self.target)))
+                record.rows_out = new_weights.nnz
+        else:
+            new_weights = old_weights
+
+        #apply the difference to the running totals
+        self.totals = self.totals + new_weights.T @ new_values - old_weights.T @ old_values
+
+        touched = np.union1d(old_weights.indices, new_weights.indices)
+        hit = touched[self.overlaps[touched] > 0]
+        upserts = self.target.iloc[hit].copy()
+        upserts[self.new_cols] = self.totals[hit]
+        return upserts, self.target.index[touched[self.overlaps[touched] == 0]]
+
+
+class IncrementalNClass:
+    """
+    N-class method that keeps its intersected polygons between runs, so that updates to a few source polygons only recompute
+    the intersected polygons of those source polygons. Value changes only rescale the interpolated values of the changed
+    source polygons. Geometry changes intersect only the changed source polygons with the ancillary data again and replace
+    their intersected polygons. See :func:`pypolate.n_class.n_class`.
+
+    The result is indexed by a fragment id that stays the same for every intersected polygon until its source geometry changes,
+    and new intersected polygons get new ids.
+
+    :param source: DataFrame with values for interpolation.
+    :type source: DataFrame
+    :param ancillary: DataFrame with area-class map categories, or a classified raster as in :func:`pypolate.n_class.n_class`.
+    :type ancillary: DataFrame or tuple
+    :param class_col: Area-class categories.
+    :type class_col: str
+    :param class_dict: Area-class categories with assigned percentages.
+    :type class_dict: dict
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param source_identifier: Column that identifies source polygons. The default is ''
+    :type source_identifier: str, optional
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. The default is True
+    :type return_geometry: bool, optional
+    """
+
+    def __init__(self, source, ancillary, class_col, class_dict, cols = [None], source_identifier = '', suffix = '', n_jobs = 1,
+                 backend = None, return_geometry = True):
+        self.ancillary = ancillary
+        self.class_col = class_col
+        self.classes, percents, _ = class_lookup([class_dict])
+        self.percents = percents[:, 0]
+        self.cols = list(cols)
+        self.new_cols = [col + suffix for col in cols]
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.return_geometry = return_geometry
+
+        self.source_index = source.index
+        self.source_attrs = source[[source_identifier] if source_identifier else []]
+        self.source_area = np.array(source.geometry.area, dtype=float)
+        self.values = np.array(source[self.cols], dtype=float)
+
+        source_index, classes, area, geometry = self._intersect(source)
+        self.fragment_source = source_index
+        self.fragment_codes = code_classes(self.classes, classes)
+        self.fragment_area = area
+        self.fraction = class_fraction(source_index, area, self.fragment_codes, self.percents, self.source_area)
+        self.fragments = self._table(source_index, classes, geometry, self.fraction, np.arange(len(source_index)))
+        self.next_id = len(source_index)
+
+    def result(self):
+        """
+        Returns the intersected polygons with interpolated columns, as :func:`pypolate.n_class.n_class` does, indexed by fragment id.
+
+        :rtype: DataFrame
+        """
+
+        return self.fragments.copy()
+
+    def update(self, changes):
+        """
+        Applies changes to existing source polygons and recomputes the intersected polygons of those source polygons.
+
+        :param changes: DataFrame indexed like the source, holding the rows that changed and any of the interpolated columns that changed. A GeoDataFrame also replaces the geometry of those rows
+        :type changes: DataFrame
+
+        :return: Intersected polygons that changed or are new, for upserting, and the fragment ids that no longer exist
+        :rtype: tuple
+        """
+
+        positions = self.source_index.get_indexer(changes.index)
+        if (positions < 0).any():
+            raise KeyError('changes hold rows that are not in the source: {}'.format(list(changes.index[positions < 0])))
+        for i, col in enumerate(self.cols):
+            if col in changes.columns:
+                self.values[positions, i] = changes[col].to_numpy(dtype=float)
+
+        affected = np.isin(self.fragment_source, positions)
+        if not isinstance(changes, gpd.GeoDataFrame):
+            #only values changed, so the fractions of the intersected polygons still hold
+            rows = np.flatnonzero(affected)
+            self.fragments.iloc[rows, [self.fragments.columns.get_loc(col) for col in self.new_cols]] = (
+                self.fraction[rows, None] * self.values[self.fragment_source[rows]])
+            return self.fragments.iloc[rows].copy(), self.fragments.index[:0]
+
+        #intersect the changed geometries again
+        with stage('reintersect', len(changes)) as record:
+            self.source_area[positions] = changes.geometry.area.to_numpy()
+            local_index, classes, area, geometry = self._intersect(changes)
+            source_index = positions[local_index]
+            codes = code_classes(self.classes, classes)
+            fraction = class_fraction(local_index, area, codes, self.percents, self.source_area[positions])
+            record.rows_out = len(local_index)
+
+        #replace the intersected polygons of the changed source polygons
+        removed = self.fragments.index[affected]
+        ids = np.arange(self.next_id, self.next_id + len(source_index))
+        self.next_id += len(source_index)
+        added = self._table(source_index, classes, geometry, fraction, ids)
+        self.fragments = pd.concat([self.fragments[~affected], added])
+        self.fragment_source = np.concatenate([self.fragment_source[~affected], source_index])
+        self.fragment_codes = np.concatenate([self.fragment_codes[~affected], codes])
+        self.fragment_area = np.concatenate([self.fragment_area[~affected], area])
+        self.fraction = np.concatenate([self.fraction[~affected], fraction])
+        return added, removed
+
+    def _intersect(self, source):
+        """Intersects source polygons with the ancillary data.
+
+        :return: Positional index in source, class, area and geometry (None without return_geometry) of each intersected polygon
+        :rtype: tuple
+        """
+
+        if is_raster(self.ancillary):
+            pieces, source_index, anc_index, area, geometry = raster_intersect(source, self.ancillary, self.class_col)
+            return source_index, pieces[self.class_col].to_numpy()[anc_index], area, geometry
+        source_index, anc_index, area, geometry = intersect(source, self.ancillary, self.n_jobs, self.backend,
+                                                            self.return_geometry)
+        return source_index, self.ancillary[self.class_col].to_numpy()[anc_index], area, geometry
+
+    def _table(self, source_index, classes, geometry, fraction, ids):
+        """Builds the output rows of intersected polygons, with the columns :func:`pypolate.n_class.n_class` returns.
+
+        :return: DataFrame indexed by fragment id
+        :rtype: DataFrame
+        """
+
+        table = join_fragments(self.source_attrs, pd.DataFrame({self.class_col: classes}), source_index,
+                               np.arange(len(source_index)), geometry)
+        table[self.new_cols] = fraction[:, None] * self.values[source_index]
+        table.index = ids
+        return table
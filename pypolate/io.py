@@ -0,0 +1,62 @@
+import json
+
+import geopandas as gpd
+
+def read_layer(path, columns = None, bbox = None):
+    """
+    Reads the features of a layer, keeping only the given attribute columns and the geometry. GeoParquet files are read with
+    pyarrow and any other file with pyogrio, so only the requested columns and the features inside bbox are loaded.
+
+    :param path: Path to a GeoParquet file or a file readable by pyogrio
+    :type path: str
+    :param columns: Attribute columns to read. The default is None, which reads every column
+    :type columns: list, optional
+    :param bbox: Bounding box (minx, miny, maxx, maxy) to filter features with. The default is None, which reads every feature
+    :type bbox: tuple, optional
+
+    :return: Features of the layer
+    :rtype: GeoDataFrame
+    """
+
+    if _is_parquet(path):
+        if columns is not None:
+            columns = [*columns, _parquet_metadata(path)['primary_column']]
+        return gpd.read_parquet(path, columns=columns, bbox=bbox)
+    return gpd.read_file(path, columns=columns, bbox=bbox, engine='pyogrio')
+
+
+def layer_bounds(path):
+    """
+    Returns the bounds of a layer without reading its features, when the file records them.
+
+    :param path: Path to a GeoParquet file or a file readable by pyogrio
+    :type path: str
+
+    :return: Bounds (minx, miny, maxx, maxy)
+    :rtype: tuple
+    """
+
+    if _is_parquet(path):
+        metadata = _parquet_metadata(path)
+        bbox = metadata['columns'][metadata['primary_column']].get('bbox')
+        if bbox:
+            return bbox
+        return read_layer(path, []).total_bounds
+
+    import pyogrio
+
+    return pyogrio.read_info(path, force_total_bounds=True)['total_bounds']
+
+
+def _is_parquet(path):
+    """Returns whether a path points to GeoParquet data."""
+
+    return str(path).lower().endswith(('.parquet', '.geoparquet'))
+
+
+def _parquet_metadata(path):
+    """Returns the GeoParquet metadata of a file."""
+
+    import pyarrow.parquet as pq
+
+    return json.loads(pq.read_schema(path).metadata[b'geo'])
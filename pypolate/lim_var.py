@@ -1,7 +1,14 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
+from scipy import sparse
 
-def  lim_var(source, ancillary, class_col, class_dict, cols = [None], source_identifier = '', suffix = ''):
+from pypolate.classes import class_lookup, code_classes
+from pypolate.operators import fragment_operator
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import profiled, stage
+from pypolate.raster import is_raster, raster_intersect
+
+@profiled
+def  lim_var(source, ancillary, class_col, class_dict, cols = [None], source_identifier = '', suffix = '', n_jobs = 1, backend = None, return_geometry = True, dtype = 'float64', return_operator = False):
     """
     The limiting variable method interpolates data into disaggregated target polygons by setting thresholds to area-class categories. 
     It accepts two DataFrames – a source and ancillary (landuse most common), the area-class column in the ancillary DataFrame, 
@@ -17,8 +24,8 @@ def  lim_var(source, ancillary, class_col, class_dict, cols = [None], source_ide
     
     :param source: DataFrame with values for interpolation
     :type source: DataFrame
-    :param ancillary: DataFrame with area-class map categories.
-    :type ancillary: DataFrame
+    :param ancillary: DataFrame with area-class map categories. A classified raster can be passed instead, as a path to a raster file or a tuple of (array, affine transform, optional nodata), in which case one row per class per source polygon is returned without geometry. See :func:`pypolate.raster.zonal_class_areas`
+    :type ancillary: DataFrame or tuple
     :param class_col: Area-class categories
     :type class_col: str
     :param class_dict: Area-class categories with assigned thresholds per square unit. Classes with no threshold should be assigned None. Classes with no data should not be included in dictionary.
@@ -29,97 +36,186 @@ def  lim_var(source, ancillary, class_col, class_dict, cols = [None], source_ide
     :type source_identifier: str, optional
     :param suffix: New name for interpolated columns. The default is ''
     :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. Without it only intersected areas are calculated and a DataFrame without geometry is returned. The default is True
+    :type return_geometry: bool, optional
+    :param dtype: Floating point type of areas, thresholds and interpolated values. 'float32' halves the memory of very large tables of intersected polygons at the cost of precision. The default is 'float64'
+    :type dtype: str, optional
+    :param return_operator: Whether to also return sparse operators from source polygons to intersected polygons, see :func:`pypolate.operators.fragment_operator`. Thresholds make the weights depend on the values, so there is one operator per interpolated column, which only reproduces the values it was built from. The default is False
+    :type return_operator: bool, optional
         
-    :return: Target DataFrame with interpolated columns.
-    :rtype: DataFrame
+    :return: Target DataFrame with interpolated columns. With return_operator, a tuple of the DataFrame and a dictionary of operators by interpolated column
+    :rtype: DataFrame or tuple
     """
 
     #calculate source area
-    source['source_area'] = source.geometry.area
-    
-    #reindex for summing excess data and used area per source polygon
-    source['_index'] = source.index
-    
-    #intersect source and ancillary
-    join1 = gpd.overlay(source, ancillary, how='intersection')
-    
-    #calculate intersected areas
-    join1['intersect_area']=join1.geometry.area
-    
-    #Assign thresholds to area classes
-    for key, value in class_dict.items():
-        join1.loc[join1[class_col]== key, 'threshold']=value
-    
-    #start interpolation for designated columns; create new_cols for target dataframe
+    source_area = source.geometry.area.to_numpy().astype(dtype)
+
+    with stage('intersect', len(source)) as record:
+        if is_raster(ancillary):
+            #count pixels of each class in every source polygon
+            ancillary, source_index, anc_index, intersect_area, geometry = raster_intersect(source, ancillary, class_col)
+        else:
+            #intersect source and ancillary, keeping the position of each source polygon
+            source_index, anc_index, intersect_area, geometry = intersect(source, ancillary, n_jobs, backend, return_geometry)
+        record.rows_out = len(source_index)
+
+    #code area classes by their position in class_dict, -1 for classes not in class_dict
+    classes, thresholds, in_dict, order = scenario_thresholds([class_dict])
+    class_codes = code_classes(classes, ancillary[class_col], anc_index)
+
+    #interpolate all designated columns together
+    values = source[list(cols)].to_numpy(dtype=dtype)
+    with stage('interpolate', len(source_index)) as record:
+        intp = lim_var_engine(source_index, intersect_area.astype(dtype), class_codes, thresholds.astype(dtype), in_dict, order,
+                              source_area, values)[:, 0]
+        record.rows_out = len(intp)
+
+    #create new_cols for target dataframe
     new_cols = []
     for col in cols:
-        source_copy = col + 'copy'
         if suffix:
             new_col = col + suffix
         else:
             new_col = '_' + col
         new_cols.append(new_col)
-        
-        #calculate areal weight
-        join1['arealwt']=join1['intersect_area']/join1['source_area']
-    
-        #copy column for interpolation (lambda in loop doesn't work first time without this)
-        join1[source_copy] = join1[col]
-        
-        #set new_col to 0 (lambda in loop doesn't work first time without this)
-        join1[new_col] = 0
-        
-        #create used area column - move area that will never be used
-        join1['used_area'] = join1.apply(lambda x: x['intersect_area'] if x[class_col] not in class_dict.keys() else 0, axis=1)
-    
-        #create copy of class_dict for multiple columns, drop values of None
-        class_dict_copy = {key:val for key, val in class_dict.items() if val != None and val != 0}
-        
-        while class_dict_copy != {}:
-        
-            #interpolate
-            join1[new_col] = join1.apply(lambda x: x['arealwt']*x[source_copy] if x[class_col] == min(class_dict_copy, key = class_dict_copy.get) else x[new_col], axis=1)
-        
-            #if new column exceeds threshold, new column gets threshold density
-            join1[new_col] = join1[new_col].clip(upper = join1['threshold']*join1['intersect_area'])
-               
-            #add up successfully interpolated data and decrement
-            totals = join1.groupby('_index')[new_col].sum()
-            totals.rename('temp_sum', inplace=True)
-            join1 = join1.merge(totals, on='_index')
-            join1[source_copy] = join1[col] - join1['temp_sum']
-            
-            #copy used area for decrementing
-            join1['used_area'] = join1.apply(lambda x: x['intersect_area'] if x[class_col] == min(class_dict_copy, key = class_dict_copy.get) else x['used_area'], axis=1)
-            
-            #add up successfully interpolated areas and decrement 
-            totals2 = join1.groupby('_index')['used_area'].sum()
-            totals2.rename('temp_area_sum', inplace=True)
-            join1 = join1.merge(totals2, on ='_index')
-            join1['source_area_copy'] = join1['source_area'] - join1['temp_area_sum']
-            
-            #recalculate areal weight
-            join1['arealwt'] = join1['intersect_area']/join1['source_area_copy']
-            
-            #remove tempsum
-            del join1['temp_sum']
-            
-            #remove temp_area_sum
-            del join1['temp_area_sum']
-            
-            #remove minimum from dictionary
-            del class_dict_copy[min(class_dict_copy, key = class_dict_copy.get)]
-
-        #replace null values with 0 for classes with no restriction
-        join1.fillna(0, inplace=True)
-        
-        #interpolate least restrictive
-        join1[new_col] = join1.apply(lambda x: x['arealwt']*x[source_copy] if x[class_col] in class_dict and x['threshold'] == 0 else x[new_col], axis=1)
 
     #filter target dataframe
-    if source_identifier:
-        target = join1[[source_identifier, class_col, "geometry", *new_cols]]
-    else:
-        target = join1[[class_col, "geometry", *new_cols]]
-        
-    return target
\ No newline at end of file
+    source_cols = [source_identifier] if source_identifier else []
+    target = join_fragments(source[source_cols], ancillary[[class_col]], source_index, anc_index, geometry)
+    target[new_cols] = intp
+
+    if return_operator:
+        #share of its source value each intersected polygon received, per column
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = intp / values[source_index]
+        operators = {col: fragment_operator(source_index, np.where(np.isfinite(shares[:, i]), shares[:, i], 0), len(source))
+                     for i, col in enumerate(new_cols)}
+        return target, operators
+    return target
+
+
+def scenario_thresholds(class_dicts):
+    """
+    Collects the area-classes and thresholds of one or more class_dict scenarios.
+
+    :param class_dicts: Area-class categories with assigned thresholds per square unit, one dictionary per scenario
+    :type class_dicts: list
+
+    :return: Index of every area-class in any scenario, thresholds per class and scenario (nan for None), whether each class is in each scenario, and the codes of the restricted classes of each scenario from most to least restrictive, padded with -1
+    :rtype: tuple
+    """
+
+    classes, thresholds, in_dict = class_lookup(class_dicts)
+    orders = []
+    for class_dict in class_dicts:
+        codes = classes.get_indexer(list(class_dict))
+        values = np.array([np.nan if value is None else value for value in class_dict.values()], dtype=float)
+
+        #restricted classes from most to least restrictive, keeping class_dict order for ties
+        orders.append([codes[i] for i in np.argsort(values, kind='stable') if not np.isnan(values[i]) and values[i] != 0])
+
+    order = np.full((max([len(codes) for codes in orders] + [0]), len(class_dicts)), -1)
+    for scenario, codes in enumerate(orders):
+        order[:len(codes), scenario] = codes
+    return classes, thresholds, in_dict, order
+
+
+def lim_var_engine(source_index, intersect_area, class_codes, thresholds, in_dict, order, source_area, values):
+    """
+    Vectorized limiting variable interpolation over intersected polygons. Every intersected polygon carries the positional
+    index of its source polygon and the code of its area-class, and per source polygon totals are accumulated with grouped sums
+    instead of merges. Classes are processed from the most restrictive threshold to the least, and all columns and threshold
+    scenarios are interpolated together as a 3-D array. Intersected polygons are sorted by class once and every pass only
+    updates the totals of the polygons of its class, so the cost does not grow with the number of classes.
+
+    :param source_index: Positional index of the source polygon for each intersected polygon
+    :type source_index: numpy.ndarray
+    :param intersect_area: Area of each intersected polygon
+    :type intersect_area: numpy.ndarray
+    :param class_codes: Position of each intersected polygon's class in thresholds, -1 for classes in no scenario
+    :type class_codes: numpy.ndarray
+    :param thresholds: Threshold per square unit for each class code and scenario, nan or 0 for classes with no threshold
+    :type thresholds: numpy.ndarray
+    :param in_dict: Whether each class code has a threshold entry in each scenario
+    :type in_dict: numpy.ndarray
+    :param order: Codes of the restricted classes of each scenario from most to least restrictive, padded with -1
+    :type order: numpy.ndarray
+    :param source_area: Area of each source polygon
+    :type source_area: numpy.ndarray
+    :param values: Values to interpolate with one row per source polygon and one column per interpolated column, in the floating point type of the result
+    :type values: numpy.ndarray
+
+    :return: Interpolated values indexed by intersected polygon, scenario and interpolated column
+    :rtype: numpy.ndarray
+    """
+
+    n_source = len(source_area)
+    n_pieces = len(source_index)
+    n_scenarios = thresholds.shape[1]
+    intp = np.zeros((n_pieces, n_scenarios, values.shape[1]), dtype=values.dtype)
+
+    #nothing to interpolate when source and ancillary share no area
+    if n_pieces == 0:
+        return intp
+
+    #sum intersected polygons per source polygon with one sparse product
+    grouping = sparse.csr_matrix((np.ones(n_pieces, dtype=values.dtype), (source_index, np.arange(n_pieces))), shape=(n_source, n_pieces))
+    def source_sum(array):
+        return (grouping @ array.reshape(n_pieces, -1)).reshape((n_source,) + array.shape[1:])
+
+    #classes of each intersected polygon that have a threshold entry in each scenario
+    known = class_codes >= 0
+    codes = np.where(known, class_codes, 0)
+    in_scenario = in_dict[codes] & known[:, None]
+
+    #move area that will never be used
+    used_area = source_sum(np.where(in_scenario, 0, intersect_area[:, None]))
+    remaining = np.repeat(values[:, None, :], n_scenarios, axis=1)
+
+    #sort intersected polygons by class once, so every pass only touches the polygons of its classes
+    by_class = np.flatnonzero(known)
+    by_class = by_class[np.argsort(class_codes[by_class], kind='stable')]
+    class_count = np.bincount(class_codes[by_class], minlength=len(thresholds))
+    class_start = np.cumsum(class_count) - class_count
+
+    #the first pass of a scenario divides by the source area, later passes by the area left
+    restricted = order[0] >= 0 if len(order) else np.zeros(n_scenarios, dtype=bool)
+    def available_area(index, scenario, started):
+        return np.where(started[scenario], source_area[index] - used_area[index, scenario], source_area[index])
+
+    for step, code in enumerate(order):
+        #intersected polygons of the class each scenario restricts in this pass
+        scenario = np.flatnonzero(code >= 0)
+        count = class_count[code[scenario]]
+        offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        piece = by_class[np.repeat(class_start[code[scenario]], count) + offset]
+        scenario = np.repeat(scenario, count)
+        index = source_index[piece]
+        area = intersect_area[piece]
+
+        #interpolate, if new column exceeds threshold new column gets threshold density
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arealwt = area / available_area(index, scenario, restricted & (step > 0))
+        piece_intp = np.minimum(arealwt[:, None] * remaining[index, scenario],
+                                (thresholds[code[scenario], scenario] * area)[:, None])
+        intp[piece, scenario] = piece_intp
+
+        #decrement successfully interpolated data and add up used areas, for the sources of this pass only
+        np.subtract.at(remaining, (index, scenario), np.where(np.isnan(piece_intp), 0, piece_intp))
+        np.add.at(used_area, (index, scenario), area)
+
+    #interpolate least restrictive
+    piece_thresholds = thresholds[codes]
+    piece, scenario = np.nonzero(in_scenario & (np.isnan(piece_thresholds) | (piece_thresholds == 0)))
+    index = source_index[piece]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arealwt = intersect_area[piece] / available_area(index, scenario, restricted)
+    arealwt[np.isnan(arealwt)] = 0
+    remaining = remaining[index, scenario]
+    intp[piece, scenario] = arealwt[:, None] * np.where(np.isnan(remaining), 0, remaining)
+
+    return np.where(np.isnan(intp), 0, intp)
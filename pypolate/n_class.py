@@ -1,7 +1,15 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
+from scipy import sparse
 
-def n_class(source, ancillary, class_col, class_dict, cols = [None], source_identifier = '', suffix = ''):
+from pypolate.classes import class_fraction, class_lookup, code_classes
+from pypolate.grid import cell_areas
+from pypolate.operators import fragment_operator
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import profiled, stage
+from pypolate.raster import is_raster, raster_intersect
+
+@profiled
+def n_class(source, ancillary, class_col, class_dict, cols = [None], source_identifier = '', suffix = '', n_jobs = 1, backend = None, return_geometry = True, dtype = 'float64', grid = None, return_operator = False):
     """
     The n-class method interpolates data into disaggregated target polygons by assigning weights to area-class categories. 
     It accepts two DataFrames – a source and ancillary (landuse most common), the area-class column in the ancillary DataFrame, 
@@ -11,12 +19,14 @@ def n_class(source, ancillary, class_col, class_dict, cols = [None], source_iden
     After intersecting, the areal weight for each new polygon is calculated and multiplied by its corresponding user-defined percentage. 
     Each of those products is then divided by the sum of all the products per source polygon. That fraction is called class_weight and is 
     multiplied by column values for interpolation. The target DataFrame is returned with interpolated columns.
+    With a :class:`pypolate.grid.Grid`, the values of every intersected polygon are spread evenly over the grid cells it
+    covers instead, and a 2-D array is returned per interpolated column.
 
 
     :param source: DataFrame with values for interpolation.
     :type source: DataFrame
-    :param ancillary: DataFrame with area-class map categories.
-    :type ancillary: DataFrame 
+    :param ancillary: DataFrame with area-class map categories. A classified raster can be passed instead, as a path to a raster file or a tuple of (array, affine transform, optional nodata), in which case one row per class per source polygon is returned without geometry. See :func:`pypolate.raster.zonal_class_areas`
+    :type ancillary: DataFrame or tuple 
     :param class_col: Area-class categories.
     :type class_col: str     
     :param class_dict: Area-class categories with assigned percentages.
@@ -27,52 +37,72 @@ def n_class(source, ancillary, class_col, class_dict, cols = [None], source_iden
     :type source_identifier: str, optional
     :param suffix: New name for interpolated columns. The default is ''
     :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. Without it only intersected areas are calculated and a DataFrame without geometry is returned. The default is True
+    :type return_geometry: bool, optional
+    :param dtype: Floating point type of areas, weights and interpolated values. 'float32' halves the memory of very large tables of intersected polygons at the cost of precision. The default is 'float64'
+    :type dtype: str, optional
+    :param grid: Regular grid to aggregate the interpolated values onto. Requires a vector ancillary. The default is None
+    :type grid: Grid, optional
+    :param return_operator: Whether to also return the sparse operator from source polygons to intersected polygons, or to every cell of the grid, see :func:`pypolate.operators.fragment_operator`. The default is False
+    :type return_operator: bool, optional
         
-    :return: Target DataFrame with interpolated columns.
-    :rtype: DataFrame
+    :return: Target DataFrame with interpolated columns, or a 2-D array per interpolated column when a grid is given, with nan in cells no intersected polygon with a class in class_dict reaches. With return_operator, a tuple of the result and the operator
+    :rtype: DataFrame or dict or tuple
     """
 
+    if grid is not None and is_raster(ancillary):
+        raise ValueError('grid needs a vector ancillary, intersected polygons of a raster have no geometry')
+
     #calculate source area
-    source['source_area'] = source.geometry.area
-    
-    #reindex source for grouping sums later
-    source['_index'] = source.index
-    
-    #assign percentages to landuse classes
-    for key, value in class_dict.items():
-        ancillary.loc[ancillary[class_col]== key, '_percent']=value
-    
-    #intersect source and ancillary data
-    join1 = gpd.overlay(source, ancillary, how='intersection')
-    
-    #calculate intersected areas
-    join1['intersect_area']=join1.geometry.area
-    
-    #calculate areal weight
-    join1['arealwt']=join1['intersect_area']/join1['source_area']
-    
-    #multiply areal weight by user defined percentages
-    join1['class_weight']=join1['_percent'] * join1['arealwt']
-    
-    #sum of areal weight times percentage per source polygon
-    totals = join1.groupby('_index')['class_weight'].sum()
-    totals.rename('temp_sum', inplace=True)
-    join1 = join1.merge(totals, on ='_index')
-    
-    #fraction for interpolation
-    join1['class_frac'] = join1['class_weight']/join1['temp_sum']
-    
-    #interpolate designated columns, create list to include in final dataframe
-    new_cols = []
-    for col in cols:
-        new_col = col + suffix
-        new_cols.append(new_col)
-        join1[new_col] = join1['class_frac']*join1[col]
-    
+    source_area = source.geometry.area.to_numpy().astype(dtype)
+
+    with stage('intersect', len(source)) as record:
+        if is_raster(ancillary):
+            #count pixels of each class in every source polygon
+            ancillary, source_index, anc_index, intersect_area, geometry = raster_intersect(source, ancillary, class_col)
+        else:
+            #intersect source and ancillary data, keeping the position of each source polygon
+            source_index, anc_index, intersect_area, geometry = intersect(source, ancillary, n_jobs, backend,
+                                                                          return_geometry or grid is not None)
+        record.rows_out = len(source_index)
+    intersect_area = intersect_area.astype(dtype)
+
+    with stage('weights', len(source_index)) as record:
+        #code landuse classes once and look their percentages up by code
+        classes, percents, _ = class_lookup([class_dict])
+        class_codes = code_classes(classes, ancillary[class_col], anc_index)
+        class_frac = class_fraction(source_index, intersect_area, class_codes, percents[:, 0].astype(dtype), source_area)
+        record.rows_out = len(class_frac)
+
+    if grid is not None:
+        #spread the values of every intersected polygon over the cells it covers, in proportion to area
+        with stage('grid', len(source_index)) as record:
+            values = class_frac[:, None] * source[list(cols)].to_numpy(dtype=dtype)[source_index]
+            valued = ~np.isnan(class_frac)
+            scale = np.where(valued, 1 / np.where(intersect_area > 0, intersect_area, np.inf), 0)
+            share = sparse.diags(scale) @ cell_areas(geometry, grid)
+            results = (share.T @ np.where(valued[:, None], values, 0)).astype(dtype, copy=False)
+            hit = np.diff(sparse.csc_matrix(share).indptr) > 0
+            results[~hit] = np.nan
+            record.rows_out = int(hit.sum())
+        results = {col + suffix: results[:, i].reshape(grid.shape) for i, col in enumerate(cols)}
+        if return_operator:
+            return results, sparse.csr_matrix(share.T @ fragment_operator(source_index, class_frac, len(source)))
+        return results
+
     #filter target dataframe
-    if source_identifier:
-        target = join1[[source_identifier, class_col, "geometry", *new_cols]]
-    else:
-        target = join1[[class_col, "geometry", *new_cols]]
-      
-    return target
\ No newline at end of file
+    source_cols = [source_identifier] if source_identifier else []
+    target = join_fragments(source[source_cols], ancillary[[class_col]], source_index, anc_index, geometry)
+
+    #interpolate designated columns
+    for col in cols:
+        target[col + suffix] = class_frac * source[col].to_numpy(dtype=dtype)[source_index]
+
+    if return_operator:
+        return target, fragment_operator(source_index, class_frac, len(source))
+    return target
+
@@ -0,0 +1,54 @@
+import numpy as np
+from scipy import sparse
+
+def fragment_operator(fragment_source, weights, n_source):
+    """
+    Builds the sparse operator that disaggregates source values into the rows of a result, where every row receives a weight
+    times the value of one source polygon. The interpolation methods return it with ``return_operator=True``, so that
+    ``operator @ source[cols].to_numpy()`` gives their interpolated columns. Operators of chained steps are combined with
+    ``@`` instead of intersecting the intermediate results again, for example to sum disaggregated parcels into tracts:
+
+        >>> parcels, (ru, ara) = parcel(block_groups, lots, 'tu', 'ru', 'ba', 'ra', ['pop'], return_operator=True)
+        >>> to_tracts = grouping_operator(parcels['tract_idx'].to_numpy(), len(tracts)) @ ru
+        >>> tract_pop = to_tracts @ block_groups['pop'].to_numpy()
+
+    Missing weights, such as those of classes left out of an n-class class_dict, give the row no value instead of nan.
+
+    :param fragment_source: Positional index of the source polygon of every row
+    :type fragment_source: numpy.ndarray
+    :param weights: Weight of every row
+    :type weights: numpy.ndarray
+    :param n_source: Number of source polygons
+    :type n_source: int
+
+    :return: Sparse matrix with one row per result row and one column per source polygon
+    :rtype: scipy.sparse.csr_matrix
+    """
+
+    weights = np.asarray(weights)
+    weights = np.where(np.isnan(weights), 0, weights)
+    operator = sparse.csr_matrix((weights, (np.arange(len(weights)), fragment_source)), shape=(len(weights), n_source))
+    operator.eliminate_zeros()
+    return operator
+
+
+def grouping_operator(index, n_groups, weights = None):
+    """
+    Builds the sparse operator that sums rows into groups, such as intersected polygons into their source, ancillary or target
+    polygon. Rows with a negative index belong to no group.
+
+    :param index: Positional index of the group of every row, -1 for none
+    :type index: numpy.ndarray
+    :param n_groups: Number of groups
+    :type n_groups: int
+    :param weights: Weight of every row in its group. The default is None, which sums rows
+    :type weights: numpy.ndarray, optional
+
+    :return: Sparse matrix with one row per group and one column per row
+    :rtype: scipy.sparse.csr_matrix
+    """
+
+    index = np.asarray(index)
+    rows = np.flatnonzero(index >= 0)
+    weights = np.ones(len(rows)) if weights is None else np.asarray(weights, dtype=float)[rows]
+    return sparse.csr_matrix((weights, (index[rows], rows)), shape=(n_groups, len(index)))
@@ -0,0 +1,305 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from pypolate.cache import active_cache
+from pypolate.profiling import profiled, stage
+
+@profiled
+def overlay(df1, df2, n_jobs = 1, backend = None, n_tiles = None):
+    """
+    Intersects two DataFrames with a choice of overlay backend. The 'geopandas' backend calls ``gpd.overlay`` directly.
+    The 'tiled' backend partitions the candidate pairs of polygons on a spatial grid and runs the intersection of each tile
+    in a process pool. Geometry is sent to the workers as WKB without any attribute columns, and each pair of polygons is
+    assigned to the tile that holds the lower left corner of the overlap of their bounding boxes, so fragments that cross tile
+    boundaries are only kept once. Both backends return the same fragments in the same order.
+
+    :param df1: First DataFrame, its attribute columns come first in the output
+    :type df1: DataFrame
+    :param df2: Second DataFrame
+    :type df2: DataFrame
+    :param n_jobs: Number of processes used by the tiled backend, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param n_tiles: Number of tiles for the tiled backend. The default is four tiles per process
+    :type n_tiles: int, optional
+
+    :return: Intersected DataFrame with the attribute columns of both inputs
+    :rtype: DataFrame
+    """
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if backend is None:
+        backend = 'geopandas' if n_jobs == 1 else 'tiled'
+
+    if backend == 'geopandas':
+        with stage('gpd.overlay', len(df1) + len(df2)) as record:
+            fragments = gpd.overlay(df1, df2, how='intersection')
+            record.rows_out = len(fragments)
+        return fragments
+    if backend != 'tiled':
+        raise ValueError("backend must be 'geopandas' or 'tiled', got {!r}".format(backend))
+
+    #find candidate pairs and the tile each pair belongs to
+    with stage('candidates', len(df1) + len(df2)) as record:
+        idx1, idx2 = df2.sindex.query(df1.geometry.values, predicate='intersects')
+        tiles = _pair_tiles(df1, df2, idx1, idx2, n_tiles or 4 * n_jobs)
+        record.rows_out = len(idx1)
+
+    #split pairs by tile, sending only the geometry each tile needs as WKB
+    wkb1 = df1.geometry.to_wkb().to_numpy()
+    wkb2 = df2.geometry.to_wkb().to_numpy()
+    tasks = []
+    for tile in np.unique(tiles):
+        tile_idx1 = idx1[tiles == tile]
+        tile_idx2 = idx2[tiles == tile]
+        geom_idx1 = np.unique(tile_idx1)
+        geom_idx2 = np.unique(tile_idx2)
+        tasks.append((tile_idx1, tile_idx2, geom_idx1, wkb1[geom_idx1], geom_idx2, wkb2[geom_idx2]))
+
+    #intersect tiles
+    with stage('tiles', len(idx1)) as record:
+        if n_jobs == 1 or len(tasks) < 2:
+            results = [_intersect_tile(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(pool.map(_intersect_tile, *zip(*tasks)))
+        record.rows_out = sum(len(result[0]) for result in results)
+
+    #put fragments in the order the serial overlay returns them
+    frag_idx1 = np.concatenate([result[0] for result in results] + [np.empty(0, dtype=int)])
+    frag_idx2 = np.concatenate([result[1] for result in results] + [np.empty(0, dtype=int)])
+    frag_wkb = np.concatenate([result[2] for result in results] + [np.empty(0, dtype=object)])
+    order = np.lexsort((frag_idx2, frag_idx1))
+
+    return join_fragments(df1, df2, frag_idx1[order], frag_idx2[order],
+                          gpd.GeoSeries.from_wkb(frag_wkb[order], crs=df1.crs).values)
+
+
+def intersect(df1, df2, n_jobs = 1, backend = None, return_geometry = True):
+    """
+    Intersects the geometry of two DataFrames without carrying any attribute columns. With return_geometry the fragments are
+    built with :func:`overlay`, otherwise only their areas are calculated with :func:`intersection_areas`. Inside
+    :func:`pypolate.cache.overlay_cache` the fragments are read from the cache when the same geometries were intersected before.
+
+    :param df1: First DataFrame
+    :type df1: DataFrame
+    :param df2: Second DataFrame
+    :type df2: DataFrame
+    :param n_jobs: Number of processes, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build fragment geometries. The default is True
+    :type return_geometry: bool, optional
+
+    :return: Positional indexes in df1 and df2, area and geometry (None without return_geometry) of each fragment
+    :rtype: tuple
+    """
+
+    if not return_geometry:
+        areas = intersection_areas(df1, df2, n_jobs, backend)
+        return areas['src_idx'].to_numpy(), areas['tgt_idx'].to_numpy(), areas['area'].to_numpy(), None
+
+    cache = active_cache()
+    if cache is not None:
+        cache_key = cache.key('fragments', df1, df2)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return (cached['idx1'], cached['idx2'], cached['area'],
+                    gpd.GeoSeries.from_wkb(cached['wkb'], crs=df1.crs).values)
+
+    geom1 = gpd.GeoDataFrame({'_idx1': np.arange(len(df1))}, geometry=df1.geometry.values, crs=df1.crs)
+    geom2 = gpd.GeoDataFrame({'_idx2': np.arange(len(df2))}, geometry=df2.geometry.values, crs=df2.crs)
+    fragments = overlay(geom1, geom2, n_jobs, backend)
+    idx1, idx2, area = fragments['_idx1'].to_numpy(), fragments['_idx2'].to_numpy(), fragments.geometry.area.to_numpy()
+
+    if cache is not None:
+        cache.put(cache_key, {'idx1': idx1, 'idx2': idx2, 'area': area, 'wkb': shapely.to_wkb(fragments.geometry.to_numpy())})
+    return idx1, idx2, area, fragments.geometry.values
+
+
+@profiled
+def intersection_areas(df1, df2, n_jobs = 1, backend = None):
+    """
+    Calculates the area of every intersection between two DataFrames without building overlay geometries or joining
+    attributes. Candidate pairs come from a spatial index query, pairs where one polygon lies entirely within the other reuse
+    that polygon's area, and the remaining pairs are intersected with vectorized shapely operations. The 'tiled' backend
+    splits the remaining pairs into chunks for a process pool. Inside :func:`pypolate.cache.overlay_cache` the areas are read
+    from the cache when the same geometries were intersected before.
+
+    :param df1: First DataFrame
+    :type df1: DataFrame
+    :param df2: Second DataFrame
+    :type df2: DataFrame
+    :param n_jobs: Number of processes, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+
+    :return: DataFrame with the positional index in df1 (src_idx), positional index in df2 (tgt_idx) and area of each intersection
+    :rtype: DataFrame
+    """
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if backend is None:
+        backend = 'geopandas' if n_jobs == 1 else 'tiled'
+    if backend not in ('geopandas', 'tiled'):
+        raise ValueError("backend must be 'geopandas' or 'tiled', got {!r}".format(backend))
+
+    cache = active_cache()
+    if cache is not None:
+        cache_key = cache.key('areas', df1, df2)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return pd.DataFrame({'src_idx': cached['idx1'], 'tgt_idx': cached['idx2'], 'area': cached['area']})
+
+    with stage('candidates', len(df1) + len(df2)) as record:
+        geom1 = make_valid(df1.geometry.to_numpy())
+        geom2 = make_valid(df2.geometry.to_numpy())
+        idx1, idx2 = df2.sindex.query(geom1, predicate='intersects', sort=True)
+        record.rows_out = len(idx1)
+
+    #pairs where one polygon is entirely within the other keep the precomputed area
+    with stage('containment', len(idx1)) as record:
+        key = idx1 * len(df2) + idx2
+        within1, within2 = df2.sindex.query(geom1, predicate='within')
+        contains1, contains2 = df2.sindex.query(geom1, predicate='contains')
+        within = np.isin(key, within1 * len(df2) + within2)
+        contains = np.isin(key, contains1 * len(df2) + contains2) & ~within
+        area = np.zeros(len(key))
+        area[within] = shapely.area(geom1[idx1[within]])
+        area[contains] = shapely.area(geom2[idx2[contains]])
+        record.rows_out = int(within.sum() + contains.sum())
+
+    #intersect the remaining pairs
+    rest = np.flatnonzero(~(within | contains))
+    with stage('intersection', len(rest)) as record:
+        if backend == 'tiled' and n_jobs > 1 and len(rest) > 1:
+            chunks = np.array_split(rest, min(4 * n_jobs, len(rest)))
+            wkb1 = [shapely.to_wkb(geom1[idx1[chunk]]) for chunk in chunks]
+            wkb2 = [shapely.to_wkb(geom2[idx2[chunk]]) for chunk in chunks]
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                area[rest] = np.concatenate(list(pool.map(_pair_areas, wkb1, wkb2)))
+        else:
+            area[rest] = shapely.area(shapely.intersection(geom1[idx1[rest]], geom2[idx2[rest]]))
+        record.rows_out = int((area[rest] > 0).sum())
+
+    #drop pairs that only touch
+    keep = area > 0
+    if cache is not None:
+        cache.put(cache_key, {'idx1': idx1[keep], 'idx2': idx2[keep], 'area': area[keep]})
+    return pd.DataFrame({'src_idx': idx1[keep], 'tgt_idx': idx2[keep], 'area': area[keep]})
+
+
+def join_fragments(df1, df2, idx1, idx2, geometry = None):
+    """
+    Builds an overlay result from intersected geometries and the positional indexes of the polygons they came from. Attribute
+    columns of both DataFrames are joined with the same '_1' and '_2' suffixes ``gpd.overlay`` uses for duplicated names.
+
+    :param df1: First DataFrame
+    :type df1: DataFrame
+    :param df2: Second DataFrame
+    :type df2: DataFrame
+    :param idx1: Positional index in df1 of each fragment
+    :type idx1: numpy.ndarray
+    :param idx2: Positional index in df2 of each fragment
+    :type idx2: numpy.ndarray
+    :param geometry: Geometry of each fragment. Without geometry a plain DataFrame of attributes is returned
+    :type geometry: GeometryArray, optional
+
+    :return: DataFrame with one row per fragment
+    :rtype: DataFrame
+    """
+
+    with stage('join', len(idx1)) as record:
+        joined = _take(df1, idx1).join(_take(df2, idx2), lsuffix='_1', rsuffix='_2')
+        record.rows_out = len(joined)
+    if geometry is None:
+        return joined
+    return gpd.GeoDataFrame(joined, geometry=geometry, crs=getattr(df1, 'crs', None))
+
+
+def _take(df, idx):
+    """Takes rows of the attribute columns of a DataFrame by position, without copying the whole DataFrame or its geometry."""
+
+    columns = np.arange(df.shape[1])
+    if isinstance(df, gpd.GeoDataFrame):
+        columns = columns[df.columns != df.geometry.name]
+    return pd.DataFrame(df.iloc[idx, columns]).reset_index(drop=True)
+
+
+def make_valid(geometry):
+    """
+    Repairs invalid geometries the way ``gpd.overlay`` does before intersecting. Valid geometries are returned unchanged,
+    without a copy when every geometry is valid.
+
+    :param geometry: Geometries
+    :type geometry: numpy.ndarray
+
+    :return: Valid geometries
+    :rtype: numpy.ndarray
+    """
+
+    invalid = ~shapely.is_valid(geometry)
+    if invalid.any():
+        geometry = geometry.copy()
+        geometry[invalid] = shapely.make_valid(geometry[invalid])
+    return geometry
+
+
+def _pair_tiles(df1, df2, idx1, idx2, n_tiles):
+    """Assigns each candidate pair to a tile of a square grid over the first DataFrame, by the lower left corner of the overlap of the pair's bounding boxes.
+
+    :return: Tile number of each pair
+    :rtype: numpy.ndarray
+    """
+
+    bounds1 = df1.geometry.bounds.to_numpy()
+    bounds2 = df2.geometry.bounds.to_numpy()
+    minx = np.maximum(bounds1[idx1, 0], bounds2[idx2, 0])
+    miny = np.maximum(bounds1[idx1, 1], bounds2[idx2, 1])
+
+    n_side = max(int(math.ceil(math.sqrt(n_tiles))), 1)
+    total_minx, total_miny, total_maxx, total_maxy = df1.total_bounds
+    width = max((total_maxx - total_minx) / n_side, np.finfo(float).tiny)
+    height = max((total_maxy - total_miny) / n_side, np.finfo(float).tiny)
+    column = np.clip(((minx - total_minx) // width).astype(int), 0, n_side - 1)
+    row = np.clip(((miny - total_miny) // height).astype(int), 0, n_side - 1)
+    return row * n_side + column
+
+
+def _intersect_tile(tile_idx1, tile_idx2, geom_idx1, wkb1, geom_idx2, wkb2):
+    """Intersects the geometry of one tile and keeps the fragments of the pairs assigned to it. Runs in a worker process.
+
+    :return: Positional indexes and WKB of the fragments
+    :rtype: tuple
+    """
+
+    df1 = gpd.GeoDataFrame({'_idx1': geom_idx1}, geometry=gpd.GeoSeries.from_wkb(wkb1).values)
+    df2 = gpd.GeoDataFrame({'_idx2': geom_idx2}, geometry=gpd.GeoSeries.from_wkb(wkb2).values)
+    fragments = gpd.overlay(df1, df2, how='intersection', keep_geom_type=True)
+
+    #drop pairs that belong to a neighbouring tile
+    pairs = pd.DataFrame({'_idx1': tile_idx1, '_idx2': tile_idx2})
+    fragments = fragments.merge(pairs, on=['_idx1', '_idx2'])
+    return (fragments['_idx1'].to_numpy(), fragments['_idx2'].to_numpy(),
+            fragments.geometry.to_wkb().to_numpy())
+
+
+def _pair_areas(wkb1, wkb2):
+    """Calculates the intersection area of each pair of WKB geometries. Runs in a worker process.
+
+    :return: Area of each intersection
+    :rtype: numpy.ndarray
+    """
+
+    return shapely.area(shapely.intersection(shapely.from_wkb(wkb1), shapely.from_wkb(wkb2)))
@@ -1,7 +1,11 @@
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 
-def parcel(zone, parcel, tu_col, ru_col, ba_col, ra_col, cols = [None]):     
+from pypolate.operators import fragment_operator
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import profiled, stage
+
+@profiled
+def parcel(zone, parcel, tu_col, ru_col, ba_col, ra_col, cols = [None], assignment = 'overlay', n_jobs = 1, backend = None, return_geometry = True, return_operator = False):     
    
     """The parcel based method disaggregates population from a large geography to the tax lot level by using residential 
     area and number of residential units as proxies for population distribution. It accepts two DataFrames, a zone DataFrame 
@@ -23,43 +27,164 @@ def parcel(zone, parcel, tu_col, ru_col, ba_col, ra_col, cols = [None]):
     :type ra_col: str
     :param cols: Column names from Zone DataFrame containing values to interpolate. Can accept one or more columns
     :type cols: list
+    :param assignment: How parcels are matched to zones. 'overlay' intersects zones and parcels exactly and returns one row per intersected polygon.
+        'point' assigns each parcel to the zone containing its representative point, and 'largest' assigns each parcel to the zone it overlaps most.
+        Both assignment modes use a spatial index instead of an overlay and return one row per assigned parcel with its original geometry. The default is 'overlay'
+    :type assignment: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. See :func:`pypolate.overlay.overlay`. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected parcels when assignment is 'overlay'. Without it a DataFrame without geometry is returned. The default is True
+    :type return_geometry: bool, optional
+    :param return_operator: Whether to also return the sparse operators from zones to matched parcels, one for RU and one for ara derived values, see :func:`pypolate.operators.fragment_operator`. The default is False
+    :type return_operator: bool, optional
     
-    :return: The parcel level DataFrame with two interpolated fields added for each column of input: One derived from residential units, and another derived from adjusted residential area
-    :rtype: DataFrame
+    :return: The parcel level DataFrame with two interpolated fields added for each column of input: One derived from residential units, and another derived from adjusted residential area. With return_operator, a tuple of the DataFrame and a tuple of the RU and ara operators
+    :rtype: DataFrame or tuple
     """    
     
-    # make copies of zone and parcel dataframes
-    ara_parcel = parcel.copy()
-    zonecopy = zone.copy()
-    
-    # calculate ara for parcels
-    ara_parcel['M'] = ara_parcel.apply(lambda x: 1 if x[ra_col]==0 and x[ru_col] !=0 else 0, axis=1)
-    ara_parcel['ara'] = (ara_parcel['M'] *((ara_parcel[ba_col] * ara_parcel[ru_col]) / ara_parcel[tu_col])) + ara_parcel[ra_col]
-    
-    # sum ara for zone
-    zonecopy['_bindex'] = zonecopy.index
-    ara_zone = gpd.overlay(zonecopy, ara_parcel, how='intersection')
-    ara_zone = ara_zone.groupby('_bindex')['ara'].sum().reset_index(name='ara_zone')         
-            
-    # calculate RU for zone
-    ru_zone = gpd.overlay(zonecopy, parcel, how='intersection')
-    ru_zone = ru_zone.groupby('_bindex')[ru_col].sum().reset_index(name='ru_zone')  
-    
+    # match parcels to zones once
+    intp_zone, zone_index, ru, ara = match_parcels(zone, parcel, tu_col, ru_col, ba_col, ra_col, assignment, n_jobs, backend,
+                                                   return_geometry)
+
     # Calculate dasymetrically derived populations based on RU and ara
-    intp_zone = gpd.overlay(zonecopy, ara_parcel, how='intersection')
-    intp_zone = intp_zone.merge(ru_zone, on='_bindex')
-    intp_zone = intp_zone.merge(ara_zone, on='_bindex')
-    new_cols = []
-    for col in cols:
-        new_col = 'ru_derived_' + col 
-        new_cols.append(new_col)
-        intp_zone[new_col] = intp_zone[col] * intp_zone[ru_col] / intp_zone['ru_zone']
-    new_cols = []    
-    for col in cols:
-        new_col = 'ara_derived_' + col 
-        new_cols.append(new_col)
-        intp_zone[new_col] = intp_zone[col] * intp_zone['ara'] / intp_zone['ara_zone']
-    
-    # drop generated columns that were just for calculations and indexing
-    intp_zone.drop(['M', '_bindex', 'ara', 'ru_zone', 'ara_zone'], axis=1, inplace = True)
-    return intp_zone
\ No newline at end of file
+    ru_share, ara_share = derive_parcels(intp_zone, zone, cols, zone_index, ru, ara)
+    if return_operator:
+        return intp_zone, (fragment_operator(zone_index, ru_share, len(zone)), fragment_operator(zone_index, ara_share, len(zone)))
+    return intp_zone
+
+
+def match_parcels(zone, parcel, tu_col, ru_col, ba_col, ra_col, assignment, n_jobs = 1, backend = None,
+                  return_geometry = True):
+    """
+    Matches parcels to zones and calculates the residential units and adjusted residential area of every matched parcel. Shared
+    by :func:`parcel` and :func:`pypolate.expert.expert`, which match parcels once and derive values from the result.
+
+    :param zone: Zone DataFrame
+    :type zone: DataFrame
+    :param parcel: Parcel DataFrame
+    :type parcel: DataFrame
+    :param tu_col: Column name from parcel DataFrame containing total number of units
+    :type tu_col: str
+    :param ru_col: Column name from parcel DataFrame containing number of residential units
+    :type ru_col: str
+    :param ba_col: Column name from parcel DataFrame containing building area
+    :type ba_col: str
+    :param ra_col: Column name from parcel DataFrame containing residential area
+    :type ra_col: str
+    :param assignment: 'overlay', 'point' or 'largest', see :func:`parcel`
+    :type assignment: str
+    :param n_jobs: Number of processes for the overlay
+    :type n_jobs: int, optional
+    :param backend: Overlay backend
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected parcels
+    :type return_geometry: bool, optional
+
+    :return: Matched parcel DataFrame, and the positional zone index, RU and ara of each matched parcel
+    :rtype: tuple
+    """
+
+    # calculate ara for parcels
+    m = ((parcel[ra_col] == 0) & (parcel[ru_col] != 0)).astype(int)
+    ara = ((m * ((parcel[ba_col] * parcel[ru_col]) / parcel[tu_col])) + parcel[ra_col]).to_numpy(dtype=float)
+
+    if assignment == 'overlay':
+        with stage('intersect', len(parcel)) as record:
+            zone_index, parcel_index, _, geometry = intersect(zone, parcel, n_jobs, backend, return_geometry)
+            record.rows_out = len(zone_index)
+        intp_zone = join_fragments(zone, parcel, zone_index, parcel_index, geometry)
+    elif assignment in ('point', 'largest'):
+        with stage('assign', len(parcel)) as record:
+            parcel_index, zone_index = _assign_parcels(zone, parcel, assignment)
+            record.rows_out = len(zone_index)
+        intp_zone = join_fragments(zone, parcel, zone_index, parcel_index, parcel.geometry.values[parcel_index])
+    else:
+        raise ValueError("assignment must be 'overlay', 'point' or 'largest', got {!r}".format(assignment))
+
+    return intp_zone, zone_index, parcel[ru_col].to_numpy(dtype=float)[parcel_index], ara[parcel_index]
+
+
+def zone_sum(zone_index, values, n_zones):
+    """
+    Sums parcel values per zone, ignoring missing values.
+
+    :param zone_index: Positional zone index of each matched parcel
+    :type zone_index: numpy.ndarray
+    :param values: Value of each matched parcel
+    :type values: numpy.ndarray
+    :param n_zones: Number of zones
+    :type n_zones: int
+
+    :return: Sum of values per zone
+    :rtype: numpy.ndarray
+    """
+
+    return np.bincount(zone_index, weights=np.where(np.isnan(values), 0, values), minlength=n_zones)
+
+
+def derive_parcels(intp_zone, zone, cols, zone_index, ru, ara):
+    """
+    Adds RU and ara derived columns to matched parcels, in place, and returns the share of its zone's values each matched
+    parcel receives.
+
+    :param intp_zone: Matched parcel DataFrame from :func:`match_parcels`
+    :type intp_zone: DataFrame
+    :param zone: Zone DataFrame
+    :type zone: DataFrame
+    :param cols: Column names from Zone DataFrame containing values to interpolate
+    :type cols: list
+    :param zone_index: Positional zone index of each matched parcel
+    :type zone_index: numpy.ndarray
+    :param ru: RU of each matched parcel
+    :type ru: numpy.ndarray
+    :param ara: ara of each matched parcel
+    :type ara: numpy.ndarray
+
+    :return: RU and ara share of each matched parcel
+    :rtype: tuple
+    """
+
+    with stage('derive', len(zone_index)) as record:
+        # sum RU and ara for zone
+        ru_zone = zone_sum(zone_index, ru, len(zone))[zone_index]
+        ara_zone = zone_sum(zone_index, ara, len(zone))[zone_index]
+
+        for col in cols:
+            intp_zone['ru_derived_' + col] = zone[col].to_numpy()[zone_index] * ru / ru_zone
+        for col in cols:
+            intp_zone['ara_derived_' + col] = zone[col].to_numpy()[zone_index] * ara / ara_zone
+        record.rows_out = len(intp_zone)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ru / ru_zone, ara / ara_zone
+
+
+def _assign_parcels(zone, parcel, assignment):
+    """Assigns each parcel to a single zone with a spatial index query. Parcels that do not fall in any zone are left out.
+
+    :param zone: Zone DataFrame
+    :type zone: DataFrame
+    :param parcel: Parcel DataFrame
+    :type parcel: DataFrame
+    :param assignment: 'point' to use the zone containing each parcel's representative point, 'largest' to use the zone with the largest overlap
+    :type assignment: str
+
+    :return: Positional parcel indexes and the positional zone index each one is assigned to
+    :rtype: tuple
+    """
+
+    if assignment == 'point':
+        parcel_index, zone_index = zone.sindex.query(parcel.geometry.representative_point().values, predicate='intersects')
+        order = np.lexsort((zone_index, parcel_index))
+    else:
+        parcel_index, zone_index = zone.sindex.query(parcel.geometry.values, predicate='intersects')
+        overlap = parcel.geometry.values[parcel_index].intersection(zone.geometry.values[zone_index]).area
+        order = np.lexsort((-overlap, parcel_index))
+        order = order[overlap[order] > 0]
+
+    # keep the first zone for each parcel
+    parcel_index, zone_index = parcel_index[order], zone_index[order]
+    parcel_index, first = np.unique(parcel_index, return_index=True)
+    return parcel_index, zone_index[first]
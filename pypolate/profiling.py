@@ -0,0 +1,205 @@
+import contextvars
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+#profiler collecting stages in the current context, None when profiling is off
+_active = contextvars.ContextVar('pypolate_profiler', default=None)
+
+REPORT_COLUMNS = ['path', 'stage', 'depth', 'seconds', 'rows_in', 'rows_out', 'peak_memory']
+
+class Profiler:
+    """
+    Collects the stages recorded by the interpolation methods while it is active. Use :func:`profile` to activate one.
+    Every stage is one dictionary in ``stages``, in the order the stages started, with its path in the call tree
+    (for example 'lim_var/intersect/gpd.overlay'), name, nesting depth, wall time in seconds, number of rows in and out and
+    peak memory in bytes above the memory in use when the stage started.
+
+    Memory is measured with tracemalloc, which follows numpy arrays and Python objects but not memory allocated by GEOS or by
+    worker processes.
+
+    :param memory: Whether to measure peak memory. The default is True
+    :type memory: bool, optional
+    :param callback: Function called with the dictionary of every stage as soon as it ends. The default is None
+    :type callback: function, optional
+    """
+
+    def __init__(self, memory = True, callback = None):
+        self.memory = memory
+        self.callback = callback
+        self.stages = []
+        self._open = []
+
+    def report(self):
+        """
+        Returns the recorded stages as a DataFrame with one row per stage.
+
+        :rtype: DataFrame
+        """
+
+        return pd.DataFrame(self.stages, columns=REPORT_COLUMNS)
+
+    def summary(self):
+        """
+        Returns the recorded stages summed by path, with the number of calls, total seconds, total rows in and out and the
+        largest peak memory of each path.
+
+        :rtype: DataFrame
+        """
+
+        return self.report().groupby('path', sort=False).agg(calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                                              rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'),
+                                                              peak_memory=('peak_memory', 'max'))
+
+
+@contextmanager
+def profile(memory = True, callback = None):
+    """
+    Profiles every interpolation run inside the with block. Profiling is off otherwise and costs nothing.
+
+        >>> with profile() as profiler:
+        ...     result = lim_var(source, ancillary, 'landuse', thresholds, ['pop'])
+        >>> profiler.summary()
+
+    :param memory: Whether to measure peak memory with tracemalloc, which slows Python allocations down. The default is True
+    :type memory: bool, optional
+    :param callback: Function called with the dictionary of every stage as soon as it ends. The default is None
+    :type callback: function, optional
+
+    :return: Profiler holding the recorded stages
+    :rtype: Profiler
+    """
+
+    profiler = Profiler(memory, callback)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _active.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _active.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def stage(name, rows_in = None):
+    """
+    Records one stage of an interpolation method when profiling is on. Used as a context manager, and the number of rows a
+    stage produced is set on it as ``rows_out``.
+
+        >>> with stage('intersect', len(source)) as record:
+        ...     fragments = overlay(source, ancillary)
+        ...     record.rows_out = len(fragments)
+
+    :param name: Name of the stage
+    :type name: str
+    :param rows_in: Number of rows going into the stage. The default is None
+    :type rows_in: int, optional
+
+    :return: Context manager recording the stage
+    :rtype: object
+    """
+
+    profiler = _active.get()
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, name, rows_in)
+
+
+def profiled(function):
+    """
+    Decorator that records every call of a function as one stage named after the function, with the length of its first
+    argument as rows in and the length of its result as rows out when they are DataFrames, arrays or sparse matrices.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = _active.get()
+        if profiler is None:
+            return function(*args, **kwargs)
+        with _Stage(profiler, function.__name__, _length(args[0]) if args else None) as record:
+            result = function(*args, **kwargs)
+            record.rows_out = _length(result)
+        return result
+
+    return wrapper
+
+
+def _length(obj):
+    """Returns the number of rows of a DataFrame, Series, array or sparse matrix, None for anything else."""
+
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)) or sparse.issparse(obj):
+        return obj.shape[0] if obj.ndim else None
+    return None
+
+
+class _Stage:
+    """Stage being recorded by a profiler."""
+
+    def __init__(self, profiler, name, rows_in):
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.path = profiler._open[-1].path + '/' + self.name if profiler._open else self.name
+        self.depth = len(profiler._open)
+        self.peak = 0
+        if profiler.memory:
+            #hand the peak so far to the open stages before measuring this one
+            current, peak = tracemalloc.get_traced_memory()
+            for stage in profiler._open:
+                stage.peak = max(stage.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+
+        #keep the place of this stage so stages are reported in the order they started
+        self.position = len(profiler.stages)
+        profiler.stages.append(None)
+        profiler._open.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler._open.pop()
+        peak_memory = None
+        if profiler.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            for stage in profiler._open:
+                stage.peak = max(stage.peak, self.peak)
+            tracemalloc.reset_peak()
+            peak_memory = max(self.peak - self.start_memory, 0)
+
+        record = {'path': self.path, 'stage': self.name, 'depth': self.depth, 'seconds': seconds, 'rows_in': self.rows_in,
+                  'rows_out': self.rows_out, 'peak_memory': peak_memory}
+        profiler.stages[self.position] = record
+        if profiler.callback is not None:
+            profiler.callback(record)
+        return False
+
+
+class _NullStage:
+    """Stage returned when profiling is off, which records nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
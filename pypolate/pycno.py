@@ -0,0 +1,154 @@
+import numpy as np
+from scipy import sparse
+
+from pypolate.grid import cell_areas
+from pypolate.profiling import profiled, stage
+
+@profiled
+def pycno(source, grid, cols = [None], suffix = '', target = None, relaxation = 0.2, tolerance = 1e-4, max_iter = 500):
+    """
+    Tobler's pycnophylactic interpolation builds a smooth surface from source polygons that keeps the value of every source
+    polygon. Source polygons are rasterized onto a grid, each cell belonging to the polygon covering most of it, and every
+    cell starts with its polygon's value spread evenly. Each iteration then replaces every cell by a blend of its value and
+    the mean of its neighbours within the source polygons, and corrects the cells of every polygon so they add up to its value
+    again without going negative. Iterations stop when no cell changes by more than tolerance times the largest cell value.
+    The surface can be returned as arrays, or summed into target polygons by the area of each cell inside them.
+
+    Source polygons too small to own a cell are not smoothed, and their values are spread over the cells they overlap. Values
+    are assumed not to be negative.
+
+    :param source: DataFrame with values for interpolation.
+    :type source: DataFrame
+    :param grid: Grid the surface is built on. Cells should be small compared to the source polygons
+    :type grid: Grid
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param target: DataFrame with polygons obtaining interpolated values. The default is None, which returns the surface
+    :type target: DataFrame, optional
+    :param relaxation: Share of its previous value every cell keeps in each iteration, between 0 and 1. The default is 0.2
+    :type relaxation: float, optional
+    :param tolerance: Largest change of a cell, relative to the largest cell value, at which iterations stop. The default is 1e-4
+    :type tolerance: float, optional
+    :param max_iter: Largest number of iterations. The default is 500
+    :type max_iter: int, optional
+
+    :return: A 2-D array per interpolated column with nan outside the source polygons, or the target DataFrame with interpolated columns added
+    :rtype: dict or DataFrame
+    """
+
+    if not 0 <= relaxation < 1:
+        raise ValueError('relaxation must be in [0, 1), got {!r}'.format(relaxation))
+    new_cols = [col + suffix for col in cols]
+    values = source[list(cols)].to_numpy(dtype=float)
+    cell_area = grid.cell_size[0] * grid.cell_size[1]
+
+    with stage('rasterize', len(source)) as record:
+        #every cell belongs to the source polygon covering most of it, when they cover at least half of it
+        areas = cell_areas(source.geometry.to_numpy(), grid)
+        entries = areas.tocoo()
+        order = np.lexsort((entries.data, entries.col))
+        cell, polygon, area = entries.col[order], entries.row[order], entries.data[order]
+        largest = np.r_[cell[1:] != cell[:-1], True] & (area >= cell_area / 2)
+        zone = np.full(len(grid), -1)
+        zone[cell[largest]] = polygon[largest]
+        zone = zone.reshape(grid.shape)
+        inside = zone >= 0
+        n_cells = np.bincount(zone[inside], minlength=len(source))
+        record.rows_out = int(inside.sum())
+
+    with stage('smooth', int(inside.sum())) as record:
+        #operators on the cells inside source polygons: mean of the neighbours, and sum per polygon
+        cells = np.flatnonzero(inside)
+        codes = zone.ravel()[cells]
+        smooth = _neighbour_mean(inside, cells)
+        grouping = sparse.csr_matrix((np.ones(len(cells)), (codes, np.arange(len(cells)))), shape=(len(source), len(cells)))
+
+        #every column is smoothed on its own, so each stops as soon as it converges
+        per_cell = np.maximum(n_cells, 1)
+        surface = np.column_stack([_smooth(smooth, grouping, codes, column, per_cell, relaxation, tolerance, max_iter)
+                                   for column in values.T])
+        record.rows_out = len(cells)
+
+    #polygons without cells keep their values evenly spread over the cells they overlap
+    full = np.zeros((len(grid), len(cols)))
+    full[cells] = surface
+    surface = full
+    valued = inside.ravel()
+    unowned = n_cells == 0
+    spread = areas[np.flatnonzero(unowned)]
+    if spread.nnz:
+        spread = sparse.diags(1 / np.maximum(np.asarray(spread.sum(axis=1)).ravel(), np.finfo(float).tiny)) @ spread
+        surface = surface + spread.T @ values[unowned]
+        valued = valued | (np.diff(sparse.csc_matrix(spread).indptr) > 0)
+    surface[~valued] = np.nan
+
+    if target is None:
+        return {col: surface[:, i].reshape(grid.shape) for i, col in enumerate(new_cols)}
+
+    with stage('targets', len(target)) as record:
+        #sum cells into target polygons by the share of every cell inside them
+        overlap = cell_areas(target.geometry.to_numpy(), grid)[:, valued] / cell_area
+        results = overlap @ surface[valued]
+        hit = np.diff(sparse.csr_matrix(overlap).indptr) > 0
+        final = target[hit].reset_index(drop=True)
+        final[new_cols] = results[hit]
+        record.rows_out = len(final)
+    return final
+
+
+def _smooth(smooth, grouping, codes, values, per_cell, relaxation, tolerance, max_iter):
+    """Iterates smoothing and volume correction for one column.
+
+    :return: Value of every cell inside source polygons
+    :rtype: numpy.ndarray
+    """
+
+    #cells start with the value of their polygon spread evenly
+    even = values / per_cell
+    surface = even[codes]
+    for _ in range(max_iter):
+        previous = surface
+        surface = relaxation * surface + (1 - relaxation) * (smooth @ surface)
+
+        #spread the missing value of every polygon evenly over its cells, then rescale after removing negative cells
+        surface = np.maximum(surface + ((values - grouping @ surface) / per_cell)[codes], 0)
+        totals = grouping @ surface
+        empty = totals <= 0
+        scale = np.divide(values, totals, out=np.zeros_like(totals), where=~empty)
+        surface = surface * scale[codes] + np.where(empty, even, 0)[codes]
+
+        if np.abs(surface - previous).max(initial=0) <= tolerance * max(np.abs(previous).max(initial=0), np.finfo(float).tiny):
+            break
+    return surface
+
+
+def _neighbour_mean(inside, cells):
+    """Builds the operator that averages the four neighbours of every cell inside source polygons, among those inside.
+    Cells without neighbours inside keep their value.
+
+    :return: Sparse matrix with one row and column per cell inside
+    :rtype: scipy.sparse.csr_matrix
+    """
+
+    n_rows, n_cols = inside.shape
+    position = np.full(inside.size, -1)
+    position[cells] = np.arange(len(cells))
+    row, col = np.divmod(cells, n_cols)
+
+    rows, neighbours = [], []
+    for row_step, col_step in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        neighbour_row, neighbour_col = row + row_step, col + col_step
+        on_grid = (neighbour_row >= 0) & (neighbour_row < n_rows) & (neighbour_col >= 0) & (neighbour_col < n_cols)
+        neighbour = np.full(len(cells), -1)
+        neighbour[on_grid] = position[neighbour_row[on_grid] * n_cols + neighbour_col[on_grid]]
+        rows.append(np.flatnonzero(neighbour >= 0))
+        neighbours.append(neighbour[neighbour >= 0])
+
+    rows, neighbours = np.concatenate(rows), np.concatenate(neighbours)
+    count = np.bincount(rows, minlength=len(cells))
+    alone = np.flatnonzero(count == 0)
+    rows, neighbours = np.r_[rows, alone], np.r_[neighbours, alone]
+    weights = 1 / np.maximum(count, 1)[rows]
+    return sparse.csr_matrix((weights, (rows, neighbours)), shape=(len(cells), len(cells)))
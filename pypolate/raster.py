@@ -0,0 +1,123 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from pypolate.profiling import profiled
+
+def read_raster(path, band = 1):
+    """
+    Reads one band of a classified raster, such as a land use GeoTIFF, for use as a raster ancillary. Requires rasterio.
+
+    :param path: Path to the raster file
+    :type path: str
+    :param band: Band number to read. The default is 1
+    :type band: int, optional
+
+    :return: Raster ancillary as a tuple of the band array, its affine transform and its nodata value
+    :rtype: tuple
+    """
+
+    import rasterio
+
+    with rasterio.open(path) as src:
+        return src.read(band), src.transform, src.nodata
+
+
+def is_raster(ancillary):
+    """
+    Returns whether an ancillary input is a raster, either a path to a raster file or a tuple of (array, transform) with an
+    optional nodata value as a third item.
+
+    :param ancillary: Ancillary input
+    :type ancillary: DataFrame, str or tuple
+
+    :rtype: bool
+    """
+
+    return isinstance(ancillary, (str, os.PathLike, tuple))
+
+
+@profiled
+def zonal_class_areas(source, ancillary):
+    """
+    Calculates the area of every raster class inside every source polygon by counting pixels. For each source polygon only
+    the window of the raster under its bounding box is tested, pixel centers inside the polygon form its zone mask, and the
+    classes under the mask are counted with ``np.bincount``. Overlapping source polygons each count the pixels they cover.
+    Nodata pixels are not counted. The raster must be north-up (no rotation).
+
+    :param source: DataFrame with source polygons, in the coordinate system of the raster
+    :type source: DataFrame
+    :param ancillary: Path to a raster file, or a tuple of (array, affine transform) with an optional nodata value as a third item
+    :type ancillary: str or tuple
+
+    :return: DataFrame with the positional index of the source polygon (src_idx), the class value (class) and the area of each class in each polygon
+    :rtype: DataFrame
+    """
+
+    if isinstance(ancillary, tuple):
+        array, transform = ancillary[:2]
+        nodata = ancillary[2] if len(ancillary) > 2 else None
+    else:
+        array, transform, nodata = read_raster(ancillary)
+    a, b, c, d, e, f = tuple(transform)[:6]
+    if b != 0 or d != 0:
+        raise ValueError('rotated rasters are not supported')
+    array = np.asarray(array)
+    n_rows, n_cols = array.shape
+
+    #code raster classes once, nodata pixels get code -1
+    classes, codes = np.unique(array, return_inverse=True)
+    missing = np.isnan(classes) if classes.dtype.kind == 'f' else np.zeros(len(classes), dtype=bool)
+    if nodata is not None:
+        missing |= classes == nodata
+    codes = np.where(missing[codes], -1, codes).reshape(array.shape)
+
+    counts = np.zeros((len(source), len(classes)), dtype=np.int64)
+    geometry = source.geometry.to_numpy()
+    for i, (minx, miny, maxx, maxy) in enumerate(source.geometry.bounds.to_numpy()):
+        if np.isnan(minx):
+            continue
+
+        #raster window under the bounding box of the polygon
+        col0, col1 = sorted(((minx - c) / a, (maxx - c) / a))
+        row0, row1 = sorted(((maxy - f) / e, (miny - f) / e))
+        col0, col1 = max(int(math.floor(col0)), 0), min(int(math.ceil(col1)), n_cols)
+        row0, row1 = max(int(math.floor(row0)), 0), min(int(math.ceil(row1)), n_rows)
+        if col0 >= col1 or row0 >= row1:
+            continue
+
+        #zone mask from pixel centers inside the polygon
+        x = c + (np.arange(col0, col1) + 0.5) * a
+        y = f + (np.arange(row0, row1) + 0.5) * e
+        shapely.prepare(geometry[i])
+        inside = shapely.contains_xy(geometry[i], *np.meshgrid(x, y))
+        window = codes[row0:row1, col0:col1][inside]
+        counts[i] = np.bincount(window[window >= 0], minlength=len(classes))
+
+    src_idx, class_idx = np.nonzero(counts)
+    return pd.DataFrame({'src_idx': src_idx, 'class': classes[class_idx],
+                         'area': counts[src_idx, class_idx] * float(abs(a * e))})
+
+
+def raster_intersect(source, ancillary, class_col):
+    """
+    Counterpart of :func:`pypolate.overlay.intersect` for raster ancillaries. Every class inside every source polygon is one
+    intersected piece, without geometry.
+
+    :param source: DataFrame with source polygons
+    :type source: DataFrame
+    :param ancillary: Path to a raster file, or a tuple of (array, affine transform) with an optional nodata value as a third item
+    :type ancillary: str or tuple
+    :param class_col: Name of the column holding the class of each piece
+    :type class_col: str
+
+    :return: DataFrame with the class of each piece, and the positional source index, positional index in that DataFrame, area and geometry (None) of each piece
+    :rtype: tuple
+    """
+
+    areas = zonal_class_areas(source, ancillary)
+    pieces = pd.DataFrame({class_col: areas['class'].to_numpy()})
+    return pieces, areas['src_idx'].to_numpy(), np.arange(len(pieces)), areas['area'].to_numpy(), None
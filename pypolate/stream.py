@@ -0,0 +1,213 @@
+import math
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from pypolate.areal import areal_weights
+from pypolate.binary import binary
+from pypolate.io import layer_bounds, read_layer
+from pypolate.n_class import n_class
+from pypolate.profiling import profiled
+
+@profiled
+def stream_areal(source_path, target_path, cols, target_identifier, suffix = '', output_path = None, n_tiles = 16):
+    """
+    Streaming version of the areal weighting method for layers that do not fit in memory. The source layer is read in spatial
+    tiles with a bounding box filter, and each source polygon is handled in the tile that holds its representative point. For
+    every tile only the target polygons inside the bounding box of its source polygons are read, and the interpolated values are
+    added to running totals per target polygon. The target layer is then read tile by tile again and written out with its
+    interpolated columns. Peak memory depends on the tile size rather than on the size of the layers.
+
+    Layers can be GeoPackages or other files read with pyogrio, or GeoParquet files written with a bbox covering column.
+
+    :param source_path: Path to the layer with values for interpolation.
+    :type source_path: str
+    :param target_path: Path to the layer with polygons obtaining interpolated values.
+    :type target_path: str
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param target_identifier: Column that uniquely identifies target polygons.
+    :type target_identifier: str
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param output_path: Path for the output, a .gpkg file or a directory of GeoParquet parts. The default is None, which returns the result instead
+    :type output_path: str, optional
+    :param n_tiles: Number of spatial tiles to split the source layer into. The default is 16
+    :type n_tiles: int, optional
+
+    :returns: Target DataFrame with interpolated columns added, or output_path when the result is written to disk
+    :rtype: DataFrame or str
+    """
+
+    new_cols = [col + suffix for col in cols]
+
+    #accumulate interpolated values per target polygon, one source tile at a time
+    totals = pd.DataFrame(columns=new_cols, dtype=float)
+    for source in _read_tiles(source_path, list(cols), n_tiles):
+        target = read_layer(target_path, [target_identifier], tuple(source.total_bounds))
+        if target.empty:
+            continue
+        weights = areal_weights(source, target)
+        hit = np.diff(weights.tocsc().indptr) > 0
+        partial = pd.DataFrame(weights.T @ source[list(cols)].to_numpy(dtype=float), columns=new_cols,
+                               index=target[target_identifier].to_numpy())
+        totals = totals.add(partial[hit].groupby(level=0).sum(), fill_value=0)
+
+    #write target polygons that received interpolated values
+    def chunks():
+        for target in _read_tiles(target_path, None, n_tiles):
+            target = target[target[target_identifier].isin(totals.index)].reset_index(drop=True)
+            target[new_cols] = totals.loc[target[target_identifier]].to_numpy()
+            yield target
+
+    return _write(chunks(), output_path)
+
+
+@profiled
+def stream_binary(source_path, ancillary_path, exclude_col, exclude_val, suffix = '', cols = [None], output_path = None,
+                  n_tiles = 16):
+    """
+    Streaming version of the binary method for layers that do not fit in memory. The source layer is read in spatial tiles
+    with a bounding box filter, and each source polygon is handled in the tile that holds its representative point. For every
+    tile only the ancillary polygons inside the bounding box of its source polygons are read, so every source polygon is
+    intersected with all of its ancillary polygons in one tile, and the result of each tile is written out before the next one
+    is read. See :func:`pypolate.binary.binary`.
+
+    :param source_path: Path to the layer with values that should be interpolated
+    :type source_path: str
+    :param ancillary_path: Path to the layer with ancillary geometry data, used to mask the source layer
+    :type ancillary_path: str
+    :param exclude_col: Column name from ancillary layer that contains exclusionary values
+    :type exclude_col: str
+    :param exclude_val: Values from exclude_col that should be removed during binary mask operation
+    :type exclude_val: list
+    :param suffix: Suffix that should be added to the column names that are interpolated
+    :type suffix: str, optional
+    :param cols: Column names that should be interpolated
+    :type cols: list
+    :param output_path: Path for the output, a .gpkg file or a directory of GeoParquet parts. The default is None, which returns the result instead
+    :type output_path: str, optional
+    :param n_tiles: Number of spatial tiles to split the source layer into. The default is 16
+    :type n_tiles: int, optional
+
+    :return: Source DataFrame with interpolated columns added, or output_path when the result is written to disk
+    :rtype: DataFrame or str
+    """
+
+    def chunks():
+        for source in _read_tiles(source_path, None, n_tiles):
+            ancillary = read_layer(ancillary_path, [exclude_col], tuple(source.total_bounds))
+            yield binary(source, ancillary, exclude_col, exclude_val, suffix, cols)
+
+    return _write(chunks(), output_path)
+
+
+@profiled
+def stream_n_class(source_path, ancillary_path, class_col, class_dict, cols = [None], source_identifier = '', suffix = '',
+                   output_path = None, n_tiles = 16):
+    """
+    Streaming version of the n-class method for layers that do not fit in memory. The source layer is read in spatial tiles
+    with a bounding box filter, and each source polygon is handled in the tile that holds its representative point. For every
+    tile only the ancillary polygons inside the bounding box of its source polygons are read, so the class weights of every
+    source polygon are summed within one tile, and the result of each tile is written out before the next one is read.
+    See :func:`pypolate.n_class.n_class`.
+
+    :param source_path: Path to the layer with values for interpolation.
+    :type source_path: str
+    :param ancillary_path: Path to the layer with area-class map categories.
+    :type ancillary_path: str
+    :param class_col: Area-class categories.
+    :type class_col: str
+    :param class_dict: Area-class categories with assigned percentages.
+    :type class_dict: dict
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param source_identifier: Column that identifies source polygons. The default is ''
+    :type source_identifier: str, optional
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param output_path: Path for the output, a .gpkg file or a directory of GeoParquet parts. The default is None, which returns the result instead
+    :type output_path: str, optional
+    :param n_tiles: Number of spatial tiles to split the source layer into. The default is 16
+    :type n_tiles: int, optional
+
+    :return: Target DataFrame with interpolated columns, or output_path when the result is written to disk
+    :rtype: DataFrame or str
+    """
+
+    source_cols = [source_identifier] if source_identifier else []
+
+    def chunks():
+        for source in _read_tiles(source_path, [*source_cols, *cols], n_tiles):
+            ancillary = read_layer(ancillary_path, [class_col], tuple(source.total_bounds))
+            yield n_class(source, ancillary, class_col, class_dict, cols, source_identifier, suffix)
+
+    return _write(chunks(), output_path)
+
+
+def _read_tiles(path, columns, n_tiles):
+    """Reads a layer one spatial tile at a time. Every feature is returned once, in the tile that holds its representative point.
+
+    :param path: Path to a GeoParquet file or a file readable by pyogrio
+    :type path: str
+    :param columns: Attribute columns to read, None reads every column
+    :type columns: list
+    :param n_tiles: Number of tiles
+    :type n_tiles: int
+
+    :return: Generator of DataFrames, one per non-empty tile
+    :rtype: generator
+    """
+
+    minx, miny, maxx, maxy = layer_bounds(path)
+    n_side = max(int(math.ceil(math.sqrt(n_tiles))), 1)
+    width = (maxx - minx) / n_side
+    height = (maxy - miny) / n_side
+
+    for row in range(n_side):
+        for column in range(n_side):
+            bbox = (minx + column * width, miny + row * height, minx + (column + 1) * width, miny + (row + 1) * height)
+            tile = read_layer(path, columns, bbox)
+            if tile.empty:
+                continue
+
+            #keep features whose representative point falls in this tile
+            point = tile.geometry.representative_point()
+            point_column = np.clip(((point.x - minx) // width).astype(int), 0, n_side - 1) if width else 0
+            point_row = np.clip(((point.y - miny) // height).astype(int), 0, n_side - 1) if height else 0
+            tile = tile[(point_column == column) & (point_row == row)]
+            if not tile.empty:
+                yield tile.reset_index(drop=True)
+
+
+def _write(chunks, output_path):
+    """Writes chunks of results as they are produced, to a GeoPackage or a directory of GeoParquet parts.
+
+    :param chunks: Generator of result DataFrames
+    :type chunks: generator
+    :param output_path: Path of a .gpkg file or a directory, None to combine the chunks in memory
+    :type output_path: str
+
+    :return: Combined results when output_path is None, otherwise output_path
+    :rtype: DataFrame or str
+    """
+
+    if output_path is None:
+        chunks = list(chunks)
+        if not chunks:
+            return gpd.GeoDataFrame()
+        return pd.concat(chunks, ignore_index=True)
+
+    part = 0
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if str(output_path).lower().endswith('.gpkg'):
+            chunk.to_file(output_path, driver='GPKG', mode='w' if part == 0 else 'a', engine='pyogrio')
+        else:
+            os.makedirs(output_path, exist_ok=True)
+            chunk.to_parquet(os.path.join(output_path, 'part-{:05d}.parquet'.format(part)))
+        part += 1
+    return output_path
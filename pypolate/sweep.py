@@ -0,0 +1,185 @@
+import numpy as np
+from scipy import sparse
+
+from pypolate.classes import class_lookup, code_classes
+from pypolate.lim_var import lim_var_engine, scenario_thresholds
+from pypolate.overlay import intersect, join_fragments
+from pypolate.profiling import profiled, stage
+from pypolate.raster import is_raster, raster_intersect
+
+@profiled
+def n_class_sweep(source, ancillary, class_col, scenarios, cols = [None], source_identifier = '', suffix = '', n_jobs = 1,
+                  backend = None, return_geometry = False, output = 'tidy', dtype = 'float64'):
+    """
+    Runs the n-class method for many class_dict scenarios at once, for sensitivity analysis. Source and ancillary data are
+    intersected once, and the percentages of every scenario are applied together as a matrix of intersected polygons by
+    scenarios. Each scenario gives the same values as :func:`pypolate.n_class.n_class` with that class_dict. Memory grows with
+    the number of intersected polygons times the number of scenarios times the number of columns.
+
+    :param source: DataFrame with values for interpolation.
+    :type source: DataFrame
+    :param ancillary: DataFrame with area-class map categories, or a classified raster as in :func:`pypolate.n_class.n_class`.
+    :type ancillary: DataFrame or tuple
+    :param class_col: Area-class categories.
+    :type class_col: str
+    :param scenarios: Area-class categories with assigned percentages, one class_dict per scenario. A dictionary of named class_dicts uses the names as scenario labels, otherwise scenarios are numbered from 0
+    :type scenarios: list or dict
+    :param cols: Column(s) from source to be interpolated.
+    :type cols: list
+    :param source_identifier: Column that identifies source polygons. The default is ''
+    :type source_identifier: str, optional
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. The default is False
+    :type return_geometry: bool, optional
+    :param output: 'tidy' for one row per scenario and intersected polygon, or 'array' for the intersected polygons and a 3-D array of interpolated values. The default is 'tidy'
+    :type output: str, optional
+    :param dtype: Floating point type of areas, weights and interpolated values. 'float32' halves the memory of the result at the cost of precision. The default is 'float64'
+    :type dtype: str, optional
+
+    :return: Tidy DataFrame with 'scenario' and 'fragment' columns, or a tuple of the intersected polygons and an array indexed by scenario, intersected polygon and column
+    :rtype: DataFrame or tuple
+    """
+
+    names, class_dicts = _scenarios(scenarios)
+    source_area = source.geometry.area.to_numpy().astype(dtype)
+    ancillary, source_index, anc_index, intersect_area, geometry = _intersect_classes(source, ancillary, class_col, n_jobs,
+                                                                                       backend, return_geometry)
+
+    with stage('interpolate', len(source_index)) as record:
+        #percentages per class and scenario, nan for classes not in a scenario
+        classes, percents, _ = class_lookup(class_dicts)
+        percents = percents.astype(dtype)
+        class_codes = code_classes(classes, ancillary[class_col], anc_index)
+        percent = np.where((class_codes >= 0)[:, None], percents[class_codes], percents.dtype.type(np.nan))
+
+        #areal weight times percentage, and its sum per source polygon for every scenario
+        class_weight = percent * (intersect_area.astype(dtype) / source_area[source_index])[:, None]
+        grouping = sparse.csr_matrix((np.ones(len(source_index), dtype=dtype), (source_index, np.arange(len(source_index)))),
+                                     shape=(len(source), len(source_index)))
+        temp_sum = grouping @ np.where(np.isnan(class_weight), 0, class_weight)
+
+        #fraction for interpolation
+        class_frac = class_weight / temp_sum[source_index]
+        values = source[list(cols)].to_numpy(dtype=dtype)[source_index]
+        intp = class_frac[:, :, None] * values[:, None, :]
+        record.rows_out = intp.shape[0] * intp.shape[1]
+
+    return _sweep_output(source, ancillary, class_col, source_identifier, source_index, anc_index, geometry, names, intp,
+                         [col + suffix for col in cols], output)
+
+
+@profiled
+def lim_var_sweep(source, ancillary, class_col, scenarios, cols = [None], source_identifier = '', suffix = '', n_jobs = 1,
+                  backend = None, return_geometry = False, output = 'tidy', dtype = 'float64'):
+    """
+    Runs the limiting variable method for many threshold scenarios at once, for sensitivity analysis. Source and ancillary data
+    are intersected once, and every scenario is interpolated together as a matrix of intersected polygons by scenarios, class
+    by class from the most to the least restrictive threshold of each scenario. Each scenario gives the same values as
+    :func:`pypolate.lim_var.lim_var` with that class_dict. Memory grows with the number of intersected polygons times the
+    number of scenarios times the number of columns.
+
+    :param source: DataFrame with values for interpolation
+    :type source: DataFrame
+    :param ancillary: DataFrame with area-class map categories, or a classified raster as in :func:`pypolate.lim_var.lim_var`
+    :type ancillary: DataFrame or tuple
+    :param class_col: Area-class categories
+    :type class_col: str
+    :param scenarios: Area-class categories with assigned thresholds per square unit, one class_dict per scenario. A dictionary of named class_dicts uses the names as scenario labels, otherwise scenarios are numbered from 0
+    :type scenarios: list or dict
+    :param cols: Column(s) from source to be interpolated
+    :type cols: list
+    :param source_identifier: Column that identifies source polygons. The default is ''
+    :type source_identifier: str, optional
+    :param suffix: New name for interpolated columns. The default is ''
+    :type suffix: str, optional
+    :param n_jobs: Number of processes for the overlay, -1 uses every core. The default is 1
+    :type n_jobs: int, optional
+    :param backend: Overlay backend, 'geopandas' or 'tiled'. The default is 'tiled' when n_jobs is not 1, otherwise 'geopandas'
+    :type backend: str, optional
+    :param return_geometry: Whether to build the geometry of intersected polygons. The default is False
+    :type return_geometry: bool, optional
+    :param output: 'tidy' for one row per scenario and intersected polygon, or 'array' for the intersected polygons and a 3-D array of interpolated values. The default is 'tidy'
+    :type output: str, optional
+    :param dtype: Floating point type of areas, weights and interpolated values. 'float32' halves the memory of the result at the cost of precision. The default is 'float64'
+    :type dtype: str, optional
+
+    :return: Tidy DataFrame with 'scenario' and 'fragment' columns, or a tuple of the intersected polygons and an array indexed by scenario, intersected polygon and column
+    :rtype: DataFrame or tuple
+    """
+
+    names, class_dicts = _scenarios(scenarios)
+    source_area = source.geometry.area.to_numpy().astype(dtype)
+    ancillary, source_index, anc_index, intersect_area, geometry = _intersect_classes(source, ancillary, class_col, n_jobs,
+                                                                                       backend, return_geometry)
+
+    with stage('interpolate', len(source_index)) as record:
+        classes, thresholds, in_dict, order = scenario_thresholds(class_dicts)
+        class_codes = code_classes(classes, ancillary[class_col], anc_index)
+        values = source[list(cols)].to_numpy(dtype=dtype)
+        intp = lim_var_engine(source_index, intersect_area.astype(dtype), class_codes, thresholds.astype(dtype), in_dict, order,
+                              source_area, values)
+        record.rows_out = intp.shape[0] * intp.shape[1]
+
+    new_cols = [col + suffix if suffix else '_' + col for col in cols]
+    return _sweep_output(source, ancillary, class_col, source_identifier, source_index, anc_index, geometry, names, intp,
+                         new_cols, output)
+
+
+def _scenarios(scenarios):
+    """Splits scenarios into their labels and their class_dicts.
+
+    :return: Scenario labels and class_dicts
+    :rtype: tuple
+    """
+
+    if isinstance(scenarios, dict):
+        return list(scenarios), list(scenarios.values())
+    return list(range(len(scenarios))), list(scenarios)
+
+
+def _intersect_classes(source, ancillary, class_col, n_jobs, backend, return_geometry):
+    """Intersects source polygons with vector or raster area-classes, as the class based methods do.
+
+    :return: DataFrame with the class of each piece, and the positional source index, positional index in that DataFrame, area and geometry of each piece
+    :rtype: tuple
+    """
+
+    with stage('intersect', len(source)) as record:
+        if is_raster(ancillary):
+            ancillary, source_index, anc_index, intersect_area, geometry = raster_intersect(source, ancillary, class_col)
+        else:
+            source_index, anc_index, intersect_area, geometry = intersect(source, ancillary, n_jobs, backend, return_geometry)
+        record.rows_out = len(source_index)
+    return ancillary, source_index, anc_index, intersect_area, geometry
+
+
+def _sweep_output(source, ancillary, class_col, source_identifier, source_index, anc_index, geometry, names, intp, new_cols,
+                  output):
+    """Builds the tidy or array output of a scenario sweep from interpolated values indexed by intersected polygon, scenario and column.
+
+    :return: Tidy DataFrame, or a tuple of the intersected polygons and an array indexed by scenario, intersected polygon and column
+    :rtype: DataFrame or tuple
+    """
+
+    if output not in ('tidy', 'array'):
+        raise ValueError("output must be 'tidy' or 'array', got {!r}".format(output))
+
+    source_cols = [source_identifier] if source_identifier else []
+    n_pieces, n_scenarios = intp.shape[:2]
+    intp = intp.transpose(1, 0, 2)
+    if output == 'array':
+        return join_fragments(source[source_cols], ancillary[[class_col]], source_index, anc_index, geometry), intp
+
+    #repeat the intersected polygons once per scenario
+    piece = np.tile(np.arange(n_pieces), n_scenarios)
+    tidy = join_fragments(source[source_cols], ancillary[[class_col]], source_index[piece], anc_index[piece],
+                          None if geometry is None else geometry[piece])
+    tidy.insert(0, 'scenario', np.repeat(np.array(names, dtype=object), n_pieces))
+    tidy.insert(1, 'fragment', piece)
+    tidy[new_cols] = intp.reshape(n_scenarios * n_pieces, len(new_cols))
+    return tidy
@@ -26,6 +26,8 @@ setup(
     classifiers=classifiers,
     keywords='spatial interpolation',
     packages=['pypolate',],
-    install_requires=['geopandas', 'pandas'],
-    python_requires=">=3.7"
+    entry_points={'console_scripts': ['pypolate=pypolate.cli:main']},
+    install_requires=['geopandas>=1.0', 'pandas', 'numpy', 'scipy', 'shapely>=2'],
+    extras_require={'io': ['pyarrow', 'pyogrio']},
+    python_requires=">=3.9"
 )
\ No newline at end of file
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import shapely
+
+from pypolate.grid import Grid, cell_areas
+
+#cells of 1.5 x 1 from (0, 0) to (9, 8)
+GRID = Grid((0, 8), (1.5, 1), (8, 6))
+
+SQUARE_WITH_HOLE = shapely.Polygon([(0.7, 0.4), (6.2, 0.4), (6.2, 5.9), (0.7, 5.9)],
+                                   [[(2.1, 1.3), (4.4, 1.3), (4.4, 3.6), (2.1, 3.6)]])
+
+CASES = {
+    'box': shapely.box(0.3, 0.2, 4.1, 3.7),
+    'hole': SQUARE_WITH_HOLE,
+    'multipolygon': shapely.MultiPolygon([shapely.box(0.2, 0.2, 1.4, 1.9), shapely.box(3.0, 4.0, 7.7, 7.6)]),
+    'reversed rings': shapely.reverse(SQUARE_WITH_HOLE),
+    'diagonal edges': shapely.Polygon([(0.4, 0.3), (8.6, 1.9), (5.2, 7.7), (2.9, 4.1), (0.9, 6.8)]),
+    'on grid lines': shapely.box(1.5, 2.0, 6.0, 5.0),
+    'partly outside': shapely.Polygon([(-2.5, -1.2), (4.3, 2.2), (11.7, -0.6), (10.4, 9.3), (3.1, 11.6)]),
+    'outside': shapely.box(20, 20, 25, 25),
+}
+
+def _overlay_areas(geometry):
+    """Intersected area of a geometry with every cell, with shapely."""
+
+    cells = GRID.polygons().geometry.to_numpy()
+    return shapely.area(shapely.intersection(geometry, cells))
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_cell_areas_match_intersection(name):
+    geometry = CASES[name]
+    areas = cell_areas(np.array([geometry]), GRID).toarray()[0]
+    np.testing.assert_allclose(areas, _overlay_areas(geometry), atol=1e-9)
+
+
+def test_cell_areas_rows_follow_geometries():
+    geometry = np.array(list(CASES.values()) + [shapely.Polygon()])
+    areas = cell_areas(geometry, GRID)
+    assert areas.shape == (len(geometry), len(GRID))
+    for row, single in enumerate(geometry[:-1]):
+        np.testing.assert_allclose(areas[row].toarray()[0], _overlay_areas(single), atol=1e-9)
+    assert areas[-1].nnz == 0
@@ -0,0 +1,78 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from pypolate.lim_var import lim_var
+
+def _boxes(n, size, offset = 0):
+    """Square polygons of a regular n x n layout."""
+
+    x, y = [coords.ravel() * size + offset for coords in np.meshgrid(np.arange(n), np.arange(n))]
+    return shapely.box(x, y, x + size, y + size)
+
+
+def _reference(source_index, area, classes, class_dict, source_area, values):
+    """Limiting variable method one source polygon at a time, following the original implementation."""
+
+    #restricted classes from most to least restrictive, in class_dict order for ties
+    restricted = [key for key in sorted(class_dict, key=lambda key: (class_dict[key] is None or class_dict[key] == 0,
+                                                                      class_dict[key] or 0))
+                  if class_dict[key] not in (None, 0)]
+    result = np.zeros(len(source_index))
+    for source in np.unique(source_index):
+        pieces = np.flatnonzero(source_index == source)
+        used = sum(area[piece] for piece in pieces if classes[piece] not in class_dict)
+        available = source_area[source]
+        remaining = values[source]
+        for key in restricted:
+            for piece in pieces:
+                if classes[piece] == key:
+                    result[piece] = min(area[piece] / available * remaining, class_dict[key] * area[piece])
+                    used += area[piece]
+            remaining = values[source] - result[pieces].sum()
+            available = source_area[source] - used
+        for piece in pieces:
+            if classes[piece] in class_dict and class_dict[classes[piece]] in (None, 0):
+                result[piece] = area[piece] / available * remaining
+    return result
+
+
+@pytest.fixture
+def layers():
+    rng = np.random.default_rng(7)
+    source = gpd.GeoDataFrame({'sid': np.arange(9), 'pop': rng.uniform(50, 500, 9)}, geometry=_boxes(3, 2.0))
+    #ancillary polygons overhang the sources, and leave part of them uncovered
+    ancillary = gpd.GeoDataFrame({'lu': rng.choice(['res', 'com', 'ind', 'park', 'water'], 64)},
+                                 geometry=_boxes(8, 0.7, offset=0.35))
+    return source, ancillary
+
+
+@pytest.mark.parametrize('class_dict', [
+    {'res': None, 'com': 5, 'ind': 20},
+    {'res': 0, 'com': 5, 'ind': 5, 'park': 1},
+    {'res': None, 'park': 0, 'com': 2},
+    {'com': 3, 'ind': 8},
+    {'res': None},
+], ids=['thresholds', 'ties and zero', 'none and zero', 'no unrestricted class', 'unrestricted only'])
+def test_lim_var_matches_reference(layers, class_dict):
+    source, ancillary = layers
+    result = lim_var(source, ancillary, 'lu', class_dict, ['pop'], source_identifier='sid')
+    expected = _reference(result['sid'].to_numpy(), result.geometry.area.to_numpy(), result['lu'].to_numpy(), class_dict,
+                          source.geometry.area.to_numpy(), source['pop'].to_numpy())
+    np.testing.assert_allclose(result['_pop'].to_numpy(), expected, rtol=1e-10, atol=1e-10)
+
+
+def test_lim_var_leaves_classes_missing_from_class_dict_empty(layers):
+    source, ancillary = layers
+    result = lim_var(source, ancillary, 'lu', {'res': None, 'com': 5}, ['pop'], suffix='_lv')
+    assert (result.loc[~result['lu'].isin(['res', 'com']), 'pop_lv'] == 0).all()
+    assert (result.loc[result['lu'] == 'com', 'pop_lv'] <= 5 * result.loc[result['lu'] == 'com'].area + 1e-9).all()
+
+
+def test_lim_var_without_intersections(layers):
+    source, ancillary = layers
+    ancillary = ancillary.set_geometry(ancillary.geometry.translate(100, 100))
+    result = lim_var(source, ancillary, 'lu', {'res': None, 'com': 5}, ['pop'])
+    assert len(result) == 0
+    assert '_pop' in result.columns